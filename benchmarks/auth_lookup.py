@@ -0,0 +1,60 @@
+"""Per-request auth lookups: list scans vs `IPNetworkTrie`/`APIKeySet`
+
+    PYTHONPATH=. python benchmarks/auth_lookup.py
+
+`baseline` is the `in` over the configured lists that `SimpleAuthMiddleware`
+ran on every request before the config was compiled, kept here as the
+reference point. Each probe set holds a hit on the last entry, a hit on the
+first entry and a miss.
+"""
+import timeit
+import ipaddress
+
+from commons_falcon.auth import APIKeySet, IPNetworkTrie
+
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def whitelist(size: int) -> list:
+    first = int(ipaddress.ip_address("10.0.0.1"))
+    return [str(ipaddress.ip_address(first + i)) for i in range(size)]
+
+
+def api_keys(size: int) -> list:
+    return ["{:032x}".format(i * 2654435761) for i in range(size)]
+
+
+def main(number: int = 20000):
+    for size in SIZES:
+        addresses, keys = whitelist(size), api_keys(size)
+        trie, key_set = IPNetworkTrie(addresses), APIKeySet(keys)
+        address_probes = (addresses[-1], addresses[0], "203.0.113.7")
+        key_probes = (keys[-1], keys[0], "f" * 32)
+
+        def baseline_ip():
+            return [probe in addresses for probe in address_probes]
+
+        def trie_ip():
+            return [probe in trie for probe in address_probes]
+
+        def baseline_key():
+            return [probe in keys for probe in key_probes]
+
+        def key_set_key():
+            return [probe in key_set for probe in key_probes]
+
+        assert baseline_ip() == trie_ip() == [True, True, False]
+        assert baseline_key() == key_set_key() == [True, True, False]
+        for name, func, kind in (
+            ("baseline", baseline_ip, "addresses"),
+            ("trie", trie_ip, "addresses"),
+            ("baseline", baseline_key, "api keys"),
+            ("key_set", key_set_key, "api keys"),
+        ):
+            best = min(timeit.repeat(func, number=number, repeat=5)) / number
+            print("{:<10}{:8.2f} us per 3 probes, N={} {}".format(name, best * 1e6, size, kind))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Per-request JSON field validation: `JsonMiddleware.get_json` vs a `ValidationPlan`
+
+    PYTHONPATH=. python benchmarks/validation_plan.py
+
+`baseline` is `JsonMiddleware.get_json` as it was before field specs were
+compiled (regexes looked up per call, choices scanned as a list), kept here
+as the reference point.
+"""
+import re
+import timeit
+import functools
+
+import six
+
+from commons_falcon.middlewares.json_middleware import JsonMiddleware, ValidationPlan
+
+
+BODY = {"name": "Ada Lovelace", "age": 36, "email": "ada@example.com", "plan": "pro"}
+
+SPECS = {
+    "name": {"dtype": str, "min": 2, "max": 64},
+    "age": {"dtype": int, "min": 18, "max": 130},
+    "email": {"dtype": str, "match": r"[^@]+@[^@]+\.[a-z]+$"},
+    "plan": {"dtype": str, "choices": ["free", "pro", "team"]},
+}
+
+
+class BaselineMiddleware(object):
+    """`JsonMiddleware.get_json`/`validate` as they were before specs were compiled"""
+
+    def __init__(self, req):
+        self.req = req
+
+    def bad_request(self, title, description):
+        raise ValueError(description)
+
+    def get_json(self, field, **kwargs):
+        value = None
+        if field in self.req.json:
+            value = self.req.json[field]
+            kwargs.pop("default", None)
+        elif "default" not in kwargs:
+            self.bad_request("Missing JSON field", "Field '{}' is required".format(field))
+        else:
+            value = kwargs.pop("default")
+        validators = kwargs
+        return self.validate(field, value, **validators)
+
+    def validate(self, field, value, dtype=None, default=None, min=None, max=None, match=None, choices=None):
+        err_title = "Validation error"
+
+        if dtype:
+            if dtype == str and type(value) in six.string_types:
+                pass
+            elif type(value) is not dtype:
+                msg = "Data type for '{}' is '{}' but should be '{}'"
+                self.bad_request(err_title, msg.format(field, type(value).__name__, dtype.__name__))
+
+        if type(value) in six.string_types:
+            if min and len(value) < min:
+                self.bad_request(err_title, "Minimum length for '{}' is '{}'".format(field, min))
+            if max and len(value) > max:
+                self.bad_request(err_title, "Maximum length for '{}' is '{}'".format(field, max))
+        elif type(value) in (int, float):
+            if min and value < min:
+                self.bad_request(err_title, "Minimum value for '{}' is '{}'".format(field, min))
+            if max and value > max:
+                self.bad_request(err_title, "Maximum value for '{}' is '{}'".format(field, max))
+
+        if match and not re.match(match, re.escape(value)):
+            self.bad_request(err_title, "'{}' does not match Regex: {}".format(field, match))
+
+        if choices and value not in choices:
+            self.bad_request(err_title, "{} must be one of {}".format(field, choices))
+        return value
+
+
+class Request(object):
+    json = BODY
+
+
+def main(number: int = 200000):
+    middleware = JsonMiddleware()
+    req = Request()
+    get_json = functools.partial(middleware.get_json, req)
+    plan = ValidationPlan(SPECS)
+    old = BaselineMiddleware(req)
+
+    def baseline_path():
+        return {field: old.get_json(field, **spec) for field, spec in SPECS.items()}
+
+    def get_json_path():
+        return {field: get_json(field, **spec) for field, spec in SPECS.items()}
+
+    def plan_path():
+        return plan.run(BODY)
+
+    assert baseline_path() == get_json_path() == plan_path()[0]
+    for name, func in (("baseline", baseline_path), ("get_json", get_json_path), ("plan", plan_path)):
+        best = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print("{:<10}{:8.2f} us per body of {} fields".format(name, best * 1e6, len(SPECS)))
+
+
+if __name__ == "__main__":
+    main()
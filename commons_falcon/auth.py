@@ -1,9 +1,17 @@
 import structlog
+import asyncio
 import enum
 import json
+import os
+import time
 import typing
-import datetime
+import weakref
+import hashlib
+import socket
+import ipaddress
+import collections
 import functools
+import threading
 
 logger = structlog.get_logger(__name__)
 
@@ -20,9 +28,14 @@ try:
 except ImportError as e:
     logger.warn("jwtcrypto module not found")
 
+try:
+    import httpx
+except ImportError as e:
+    logger.warn("httpx module not found")
+
 
 
-__all__ = ('AuthorizationScheme', 'AccessLevel', 'JWTVerificationError', 'timed_lru_cache', 'JWTVerifyService',)
+__all__ = ('AuthorizationScheme', 'AccessLevel', 'JWTVerificationError', 'TTLCache', 'timed_lru_cache', 'JWKStore', 'ClaimsCache', 'AccessTokenCache', 'IPNetworkTrie', 'APIKeySet', 'JWTVerifyService', 'AsyncJWKStore', 'AsyncJWTVerifyService',)
 
 class AuthorizationScheme(enum.Enum):
     JWT = "jwt"
@@ -45,47 +58,522 @@ class JWTVerificationError(enum.Enum):
     INTERNAL = "internal"
 
 
-def timed_lru_cache(seconds: int, maxsize: int = 128):
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"])
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Thread-safe LRU cache where every entry carries its own expiry.
+
+    `get_or_load` coalesces concurrent misses for the same key so only one
+    caller runs the loader, the others wait for its result (or exception).
+    `ttl` may be a number of seconds or a callable deriving it from the loaded
+    value; a non-positive TTL leaves the value uncached.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: "float" = 60) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__entries: "collections.OrderedDict[typing.Hashable, tuple]" = collections.OrderedDict()
+        self.__flights: "typing.Dict[typing.Hashable, _Flight]" = {}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __lookup(self, key) -> tuple:
+        entry = self.__entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return True, value
+            del self.__entries[key]
+        self.__misses += 1
+        return False, None
+
+    def __ttl_for(self, value, ttl) -> "float":
+        if ttl is None:
+            return self.ttl
+        if callable(ttl):
+            ttl = ttl(value)
+            return self.ttl if ttl is None else ttl
+        return ttl
+
+    def get(self, key, default=None):
+        with self.__lock:
+            hit, value = self.__lookup(key)
+        return value if hit else default
+
+    def set(self, key, value, ttl=None) -> None:
+        ttl = self.__ttl_for(value, ttl)
+        if ttl <= 0:
+            return
+
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def get_or_load(self, key, loader: "typing.Callable[[], typing.Any]", ttl=None):
+        with self.__lock:
+            hit, value = self.__lookup(key)
+            if hit:
+                return value
+
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value, ttl)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.__lock:
+                self.__flights.pop(key, None)
+            flight.event.set()
+
+    def delete(self, key) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def info(self) -> CacheInfo:
+        with self.__lock:
+            return CacheInfo(self.__hits, self.__misses, self.__evictions, self.maxsize, len(self.__entries))
+
+
+_KWARGS_MARK = object()
+
+
+def timed_lru_cache(seconds: int, maxsize: int = 128, weak_self: bool = False):
+    """Memoize a function in a `TTLCache` with a per-entry TTL of `seconds`.
+
+    With `weak_self` the first positional argument (the instance of a method)
+    is keyed through a weak reference so cached entries do not keep it alive.
+    The cache is exposed as `cache`, along with `cache_info` and `cache_clear`.
+    """
+
     def wrapper_cache(func):
-        func = functools.lru_cache(maxsize=maxsize)(func)
-        func.lifetime = datetime.timedelta(seconds=seconds)
-        func.expiration = datetime.datetime.utcnow() + func.lifetime
+        cache = TTLCache(maxsize=maxsize, ttl=seconds)
 
         @functools.wraps(func)
         def wrapped_func(*args, **kwargs):
-            if datetime.datetime.utcnow() >= func.expiration:
-                func.cache_clear()
-                func.expiration = datetime.datetime.utcnow() + func.lifetime
+            key = args
+            if weak_self and args:
+                key = (weakref.ref(args[0]),) + args[1:]
+            if kwargs:
+                key += (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
 
-            result = func(*args, **kwargs)
-            return result
+            return cache.get_or_load(key, lambda: func(*args, **kwargs))
 
+        wrapped_func.cache = cache
+        wrapped_func.cache_info = cache.info
+        wrapped_func.cache_clear = cache.clear
         return wrapped_func
 
     return wrapper_cache
 
 
+class JWKStore:
+    """Parsed keys of a JWKS endpoint indexed by `kid`.
+
+    Keys are parsed once per fetch and refreshed by a daemon thread every
+    `refresh_interval` seconds. A failed refresh keeps serving the previous
+    keys (stale-while-revalidate) and is retried after `retry_interval`.
+    A lookup for an unknown `kid` triggers at most one refetch per
+    `min_refetch_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        fetch: "typing.Callable[[], typing.Optional[dict]]",
+        refresh_interval: "int" = 3600,
+        retry_interval: "int" = 30,
+        min_refetch_interval: "int" = 30,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.__fetch = fetch
+        self.__keys: "typing.Dict[str, jwk.JWK]" = {}
+        self.__key_set: "typing.Optional[jwk.JWKSet]" = None
+        self.__fetched_at = None
+        self.__start_lock = threading.Lock()
+        self.__fetch_lock = threading.Lock()
+        self.__pid = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.__key_set is not None
+
+    def start(self) -> None:
+        """Load the keys and start the refresh thread of the current process.
+
+        Called lazily on first lookup, it can be called ahead of time (e.g.
+        from a `post_fork` hook) to keep the initial fetch off the first request.
+        Threads do not survive a fork, so the store restarts itself per pid.
+        """
+        if self.__pid == os.getpid():
+            return
+
+        with self.__start_lock:
+            if self.__pid == os.getpid():
+                return
+
+            if not self.loaded:
+                self.refresh()
+
+            thread = threading.Thread(target=self.__run, name="jwk-store-refresh", daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+
+    def refresh(self) -> bool:
+        with self.__fetch_lock:
+            return self.__refresh()
+
+    def get_key(self, kid: "typing.Optional[str]") -> "typing.Union[jwk.JWK, jwk.JWKSet, None]":
+        """Key for `kid`, or the whole key set when the token carries no `kid`"""
+        self.start()
+
+        if kid is None:
+            return self.__key_set
+
+        key = self.__keys.get(kid)
+        if key is not None:
+            return key
+
+        self.__refetch()
+        return self.__keys.get(kid)
+
+    def __refetch(self) -> None:
+        with self.__fetch_lock:
+            if (
+                self.__fetched_at is not None
+                and time.monotonic() - self.__fetched_at < self.min_refetch_interval
+            ):
+                return
+            self.__refresh()
+
+    @staticmethod
+    def parse(jwk_api_response: dict) -> "tuple[typing.Dict[str, jwk.JWK], jwk.JWKSet]":
+        key_set = jwk.JWKSet.from_json(json.dumps(jwk_api_response))
+        keys = {key.key_id: key for key in key_set["keys"] if key.key_id is not None}
+        return keys, key_set
+
+    def __refresh(self) -> bool:
+        self.__fetched_at = time.monotonic()
+        try:
+            jwk_api_response = self.__fetch()
+            if not jwk_api_response:
+                logger.warn("jwk fetch returned no keys, serving stale keys")
+                return False
+
+            keys, key_set = self.parse(jwk_api_response)
+        except Exception as e:
+            logger.error("jwk refresh failed, serving stale keys", error=str(e))
+            return False
+
+        # single reference swaps, readers never observe a partial update
+        self.__keys = keys
+        self.__key_set = key_set
+        return True
+
+    def __run(self) -> None:
+        succeeded = self.loaded
+        while True:
+            time.sleep(self.refresh_interval if succeeded else self.retry_interval)
+            succeeded = self.refresh()
+
+
+class ClaimsCache:
+    """Bounded, thread-safe LRU of verification results keyed by the token digest.
+
+    Verified claims are kept until `max_ttl` or the token's own `exp`, whichever
+    comes first. Rejected tokens are negatively cached for `negative_ttl` seconds.
+    Cached claims are shared between requests and must be treated as read-only.
+    """
+
+    NEGATIVE_ERRORS = (JWTVerificationError.EXPIRED, JWTVerificationError.INVALID)
+
+    def __init__(self, maxsize: int = 10000, max_ttl: int = 300, negative_ttl: int = 5) -> None:
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.__cache = TTLCache(maxsize=maxsize, ttl=max_ttl)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def ttl(self, result: tuple) -> "float":
+        error, claims = result
+        if error is None:
+            expires = claims.get("exp") if isinstance(claims, dict) else None
+            if isinstance(expires, (int, float)):
+                return min(self.max_ttl, expires - time.time())
+            return self.max_ttl
+        if error in self.NEGATIVE_ERRORS:
+            return self.negative_ttl
+        return 0
+
+    def get(self, token: str) -> "typing.Optional[tuple]":
+        return self.__cache.get(self.digest(token))
+
+    def set(self, token: str, result: tuple) -> None:
+        self.__cache.set(self.digest(token), result, self.ttl)
+
+    def get_or_verify(self, token: str, verify: "typing.Callable[[str], tuple]") -> tuple:
+        return self.__cache.get_or_load(self.digest(token), lambda: verify(token), self.ttl)
+
+    def clear(self) -> None:
+        self.__cache.clear()
+
+    def stats(self) -> dict:
+        return self.__cache.info()._asdict()
+
+
+class AccessTokenCache:
+    """Access token to OAuth user cache for `SimpleAuthMiddleware`.
+
+    Entries live in-process, and optionally in Redis to share them between
+    workers. A user is cached until the introspected token expires (capped at
+    `max_ttl`), a rejected token for `negative_ttl` seconds. Concurrent lookups
+    of the same token within a process are coalesced into a single load.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        max_ttl: int = 300,
+        negative_ttl: int = 5,
+        redis_client: "typing.Optional[typing.Any]" = None,
+        key_prefix: str = "commons_falcon:access_token:",
+    ) -> None:
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.__cache = TTLCache(maxsize=maxsize, ttl=max_ttl)
+
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def ttl(self, entry: dict) -> "float":
+        if entry.get("user") is None:
+            return self.negative_ttl
+        return max(0, min(self.max_ttl, entry["expires_at"] - time.time()))
+
+    def token_expiry(self, introspection: "typing.Optional[dict]") -> "float":
+        """Absolute expiry from an RFC 7662 introspection response"""
+        now = time.time()
+        if isinstance(introspection, dict):
+            if isinstance(introspection.get("exp"), (int, float)):
+                return min(introspection["exp"], now + self.max_ttl)
+            if isinstance(introspection.get("expires_in"), (int, float)):
+                return now + min(introspection["expires_in"], self.max_ttl)
+        return now + self.max_ttl
+
+    def get_or_load(
+        self,
+        token: str,
+        loader: "typing.Callable[[str], tuple[typing.Optional[dict], typing.Optional[dict]]]",
+    ) -> "typing.Optional[dict]":
+        """OAuth user for `token`, or None if it was rejected.
+
+        `loader` returns the `(user, introspection)` pair for the token, with
+        user set to None when the token is rejected.
+        """
+        digest = self.digest(token)
+        entry = self.__cache.get_or_load(digest, lambda: self.__load(digest, token, loader), self.ttl)
+        return entry.get("user")
+
+    def __load(self, digest: str, token: str, loader) -> dict:
+        key = self.key_prefix + digest
+        if self.redis_client is not None:
+            try:
+                cached = self.redis_client.get(key)
+                if cached is not None:
+                    return json.loads(cached)
+            except Exception as e:
+                logger.error("access token cache read failed", error=str(e))
+
+        user, introspection = loader(token)
+        entry = {"user": user, "expires_at": self.token_expiry(introspection)}
+
+        ttl = self.ttl(entry)
+        if self.redis_client is not None and ttl > 0:
+            try:
+                self.redis_client.set(key, json.dumps(entry), px=int(ttl * 1000))
+            except Exception as e:
+                logger.error("access token cache write failed", error=str(e))
+        return entry
+
+    def delete(self, token: str) -> None:
+        digest = self.digest(token)
+        self.__cache.delete(digest)
+        if self.redis_client is not None:
+            self.redis_client.delete(self.key_prefix + digest)
+
+    def stats(self) -> dict:
+        return self.__cache.info()._asdict()
+
+
+class IPNetworkTrie:
+    """Binary trie of IPv4/IPv6 networks for whitelist matching.
+
+    Accepts single addresses and CIDR ranges. Membership walks at most one
+    node per prefix bit, so the cost is bounded by the address length rather
+    than by the number of whitelisted networks.
+    """
+
+    def __init__(self, networks: "typing.Iterable[str]" = ()) -> None:
+        # nodes are [zero child, one child, network ends here]
+        self.__roots = {4: [None, None, False], 6: [None, None, False]}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network: str) -> None:
+        network = ipaddress.ip_network(network, strict=False)
+        node = self.__roots[network.version]
+        address = int(network.network_address)
+        for shift in range(network.max_prefixlen - 1, network.max_prefixlen - network.prefixlen - 1, -1):
+            if node[2]:
+                return
+            bit = (address >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+
+    def __contains__(self, address: "typing.Optional[str]") -> bool:
+        # inet_pton is several times cheaper than ipaddress parsing per request
+        try:
+            if ":" in address:
+                node, packed = self.__roots[6], socket.inet_pton(socket.AF_INET6, address)
+            else:
+                node, packed = self.__roots[4], socket.inet_pton(socket.AF_INET, address)
+        except (OSError, TypeError):
+            return False
+
+        value = int.from_bytes(packed, "big")
+        shift = len(packed) * 8
+        while node is not None:
+            if node[2]:
+                return True
+            shift -= 1
+            if shift < 0:
+                return False
+            node = node[(value >> shift) & 1]
+        return False
+
+
+class APIKeySet:
+    """Set of API key digests.
+
+    Incoming keys are hashed before the lookup so the comparison never runs
+    over secret material and its timing reveals nothing about stored keys.
+    """
+
+    def __init__(self, keys: "typing.Iterable[str]" = ()) -> None:
+        self.__digests = frozenset(self.digest(key) for key in keys)
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode("utf-8")).digest()
+
+    def __contains__(self, key: "typing.Optional[str]") -> bool:
+        if not key:
+            return False
+        return self.digest(key) in self.__digests
+
+    def __len__(self) -> int:
+        return len(self.__digests)
+
+
 class JWTVerifyService:
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self,
+        url: str,
+        refresh_interval: int = 3600,
+        min_refetch_interval: int = 30,
+        timeout: int = 10,
+        claims_cache: "typing.Optional[ClaimsCache]" = None,
+    ) -> None:
         self.service_url = url
+        self.timeout = timeout
+        self.claims_cache = claims_cache
+        self.key_store = JWKStore(
+            self.fetch_jwk,
+            refresh_interval=refresh_interval,
+            min_refetch_interval=min_refetch_interval,
+        )
 
-    @timed_lru_cache(3600)
     def fetch_jwk(self):
         headers = {"X-Api-Version": "v1"}
-        response = requests.get(self.service_url, headers=headers)
+        response = requests.get(self.service_url, headers=headers, timeout=self.timeout)
         if response.status_code != 200:
             return None
 
         return response.json()
 
+    @staticmethod
+    def token_kid(token: str) -> "typing.Optional[str]":
+        header = json.loads(jwt_commons.base64url_decode(token.split(".", 1)[0]))
+        if not isinstance(header, dict):
+            raise ValueError("Invalid JOSE header")
+        return header.get("kid")
+
     def verify(self, token: str) -> "typing.Union[tuple[JWTVerificationError, None], tuple[None, str]]":
+        if self.claims_cache is None:
+            return self.verify_signature(token)
+
+        return self.claims_cache.get_or_verify(token, self.verify_signature)
+
+    def verify_signature(self, token: str) -> "typing.Union[tuple[JWTVerificationError, None], tuple[None, str]]":
         try:
-            jwk_api_response = self.fetch_jwk()
-            if not jwk_api_response:
+            kid = self.token_kid(token)
+        except ValueError:
+            return JWTVerificationError.INVALID, None
+
+        return self.decode(token, self.key_store.get_key(kid), self.key_store.loaded)
+
+    @staticmethod
+    def decode(
+        token: str, key: "typing.Union[jwk.JWK, jwk.JWKSet, None]", loaded: bool = True
+    ) -> "typing.Union[tuple[JWTVerificationError, None], tuple[None, str]]":
+        if key is None:
+            if not loaded:
                 return JWTVerificationError.INTERNAL, None
+            return JWTVerificationError.INVALID, None
 
-            jwk_set = jwk.JWKSet.from_json(json.dumps(jwk_api_response))
-            decoded_token = jwt.JWT(key=jwk_set, jwt=token)
+        try:
+            decoded_token = jwt.JWT(key=key, jwt=token)
             claims = json.loads(decoded_token.claims)
 
             return None, claims
@@ -96,3 +584,150 @@ class JWTVerifyService:
             return JWTVerificationError.INVALID, None
 
 
+class AsyncJWKStore:
+    """asyncio counterpart of `JWKStore`.
+
+    Refreshes run as a task on the running event loop, so neither the
+    periodic refresh nor the unknown `kid` refetch block the loop.
+    """
+
+    def __init__(
+        self,
+        fetch: "typing.Callable[[], typing.Awaitable[typing.Optional[dict]]]",
+        refresh_interval: "int" = 3600,
+        retry_interval: "int" = 30,
+        min_refetch_interval: "int" = 30,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.min_refetch_interval = min_refetch_interval
+        self.__fetch = fetch
+        self.__keys: "typing.Dict[str, jwk.JWK]" = {}
+        self.__key_set: "typing.Optional[jwk.JWKSet]" = None
+        self.__fetched_at = None
+        self.__fetch_lock = None
+        self.__task = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.__key_set is not None
+
+    async def start(self) -> None:
+        if self.__task is not None and not self.__task.done():
+            return
+
+        if self.__fetch_lock is None:
+            self.__fetch_lock = asyncio.Lock()
+
+        if not self.loaded:
+            await self.refresh()
+
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def refresh(self) -> bool:
+        async with self.__fetch_lock:
+            return await self.__refresh()
+
+    async def get_key(self, kid: "typing.Optional[str]") -> "typing.Union[jwk.JWK, jwk.JWKSet, None]":
+        await self.start()
+
+        if kid is None:
+            return self.__key_set
+
+        key = self.__keys.get(kid)
+        if key is not None:
+            return key
+
+        async with self.__fetch_lock:
+            if (
+                self.__fetched_at is None
+                or time.monotonic() - self.__fetched_at >= self.min_refetch_interval
+            ):
+                await self.__refresh()
+        return self.__keys.get(kid)
+
+    async def __refresh(self) -> bool:
+        self.__fetched_at = time.monotonic()
+        try:
+            jwk_api_response = await self.__fetch()
+            if not jwk_api_response:
+                logger.warn("jwk fetch returned no keys, serving stale keys")
+                return False
+
+            keys, key_set = JWKStore.parse(jwk_api_response)
+        except Exception as e:
+            logger.error("jwk refresh failed, serving stale keys", error=str(e))
+            return False
+
+        self.__keys = keys
+        self.__key_set = key_set
+        return True
+
+    async def __run(self) -> None:
+        succeeded = self.loaded
+        while True:
+            await asyncio.sleep(self.refresh_interval if succeeded else self.retry_interval)
+            succeeded = await self.refresh()
+
+
+class AsyncJWTVerifyService(JWTVerifyService):
+    """`JWTVerifyService` for asyncio applications (e.g. `falcon.asgi`).
+
+    JWKS requests go through an `httpx.AsyncClient`; pass a shared `client`
+    to reuse one connection pool across services.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        refresh_interval: int = 3600,
+        min_refetch_interval: int = 30,
+        timeout: int = 10,
+        claims_cache: "typing.Optional[ClaimsCache]" = None,
+        client: "typing.Optional[httpx.AsyncClient]" = None,
+    ) -> None:
+        self.service_url = url
+        self.timeout = timeout
+        self.claims_cache = claims_cache
+        self.client = client
+        self.key_store = AsyncJWKStore(
+            self.fetch_jwk,
+            refresh_interval=refresh_interval,
+            min_refetch_interval=min_refetch_interval,
+        )
+
+    async def fetch_jwk(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout)
+
+        headers = {"X-Api-Version": "v1"}
+        response = await self.client.get(self.service_url, headers=headers)
+        if response.status_code != 200:
+            return None
+
+        return response.json()
+
+    async def verify(self, token: str) -> "typing.Union[tuple[JWTVerificationError, None], tuple[None, str]]":
+        if self.claims_cache is None:
+            return await self.verify_signature(token)
+
+        result = self.claims_cache.get(token)
+        if result is None:
+            result = await self.verify_signature(token)
+            self.claims_cache.set(token, result)
+        return result
+
+    async def verify_signature(self, token: str) -> "typing.Union[tuple[JWTVerificationError, None], tuple[None, str]]":
+        try:
+            kid = self.token_kid(token)
+        except ValueError:
+            return JWTVerificationError.INVALID, None
+
+        key = await self.key_store.get_key(kid)
+        return self.decode(token, key, self.key_store.loaded)
@@ -63,6 +63,14 @@ try:
         return f'{path}:{method.upper()}:{query_keys}'
 
 
+    def serialize(self, req, resp, resource) -> bytes:
+        """ Serialize the response for caching, `JsonMiddleware` renders to `resp.data` """
+        body = resp.text if resp.text is not None else resp.data
+        if self.cache_config['CACHE_CONTENT_TYPE_JSON_ONLY']:
+            return body
+        return caching_middleware.msgpack.packb([resp.content_type, body], use_bin_type=True)
+
+
     def get_default_redis_cache(
         host: "str" = "localhost",
         port: "int" = 6379,
@@ -89,12 +97,14 @@ try:
 
     caching.Cache.cached = cached
     caching_middleware.Middleware.generate_cache_key = generate_cache_key
+    caching_middleware.Middleware.serialize = serialize
 except ImportError as e:
     logger.warn("Falcon Caching is not installed")
     logger.warn("Impelementing stubs")
     cached = None
     get_default_redis_cache = None
     generate_cache_key = None
+    serialize = None
 
 
 # from falcon_caching import Cache, middleware
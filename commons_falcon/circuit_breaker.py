@@ -0,0 +1,63 @@
+import enum
+import time
+import threading
+
+__all__ = ('CircuitBreaker', )
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for calls to a remote dependency.
+
+    The circuit opens after `failure_threshold` consecutive failures, and calls
+    are refused right away instead of waiting on the dependency. Once
+    `reset_timeout` seconds have passed a single trial call is let through
+    (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    class State(enum.Enum):
+        CLOSED = "closed"
+        OPEN = "open"
+        HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: "int" = 5, reset_timeout: "float" = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__state = self.State.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> "CircuitBreaker.State":
+        return self.__state
+
+    def allow(self) -> bool:
+        if self.__state == self.State.CLOSED:
+            return True
+
+        with self.__lock:
+            if (
+                self.__state == self.State.OPEN
+                and time.monotonic() - self.__opened_at >= self.reset_timeout
+            ):
+                self.__state = self.State.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        if self.__state == self.State.CLOSED and self.__failures == 0:
+            return
+
+        with self.__lock:
+            self.__failures = 0
+            self.__state = self.State.CLOSED
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            if (
+                self.__state == self.State.HALF_OPEN
+                or self.__failures >= self.failure_threshold
+            ):
+                self.__state = self.State.OPEN
+                self.__opened_at = time.monotonic()
@@ -1,4 +1,5 @@
 from .serialize_schema import SerializeSchema
-from .validate_schema import ValidateParams, ValidateSchema
+from .validate_schema import ValidateParams, ValidateSchema, ValidateFields
 from .map_query import MapQuery
-from .authorize_payload import AuthorizePayload
\ No newline at end of file
+from .authorize_payload import AuthorizePayload
+from .etag_version import ETagVersion
\ No newline at end of file
@@ -0,0 +1,42 @@
+import typing
+import structlog
+from commons_falcon.middlewares.etag_middleware import version_etag, etag_matches
+
+logger = structlog.get_logger(__name__)
+
+try:
+    import falcon
+except ImportError as e:
+    logger.warn("falcon module not found")
+
+
+class ETagVersion(object):
+    """Answer a matching `If-None-Match` from a cheap version key, before the responder runs
+
+    `version(req, params)` (default: the resource's `etag_version`) returns a key
+    (e.g. a document's `updated_at`) covering everything the response depends on,
+    or None to let `ETagMiddleware` hash the body. Being a `falcon.before` hook it
+    runs after every middleware's `process_resource`, so authorization and rate
+    limiting still apply to requests answered with 304.
+    """
+
+    def __init__(self, version: "typing.Optional[typing.Callable]" = None, methods: "typing.Iterable[str]" = ("GET", "HEAD")):
+        self.version = version
+        self.methods = frozenset(methods)
+
+    def __call__(self, req, resp, resource, params):
+        if req.method not in self.methods:
+            return
+
+        version = self.version or getattr(resource, "etag_version", None)
+        if version is None:
+            return
+
+        key = version(req, params)
+        if key is None:
+            return
+
+        etag = version_etag(key)
+        req.context["etag"] = etag
+        if etag_matches(req.get_header("If-None-Match"), etag):
+            raise falcon.HTTPStatus(falcon.HTTP_304, headers={"ETag": etag})
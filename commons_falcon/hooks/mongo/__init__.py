@@ -1,46 +1,77 @@
 from typing import Union, Type, List, Optional, Dict
 from mongoengine import DynamicDocument, Document
 from .inject_model import inject_model
+from .loader import ModelLoader, BatchInject
+from .model_cache import ModelCache
+from .pagination import CursorPagination
+from ..serialize_schema import schema_projection
 
 class InjectModels(object):
 
-    def __init__(self, model: "Type[Union[DynamicDocument,Document]]", attr: str, fields: "List[str]", deleted=False, alias: "Optional[Dict]"=None):
+    def __init__(self, model: "Type[Union[DynamicDocument,Document]]", attr: str, fields: "List[str]", deleted=False, alias: "Optional[Dict]"=None, schema=None, cache: "Optional[ModelCache]"=None):
+        """schema: marshmallow schema the injected objects are read through,
+        only the document fields it reads (and `attr`) are loaded
+
+        cache: `ModelCache` to read the documents through, cached documents are
+        whole (`schema` projection is not applied) and `deleted` is checked in process
+        """
         self.fields = fields
         self.model: "Type[Union[DynamicDocument,Document]]" = model
         self.attr = attr
         self.deleted = deleted
         self.alias = alias
+        self.cache = cache
+        self.only = None
+        if schema is not None:
+            projection = schema_projection(schema(), model)
+            if projection:
+                self.only = tuple(set(projection) | {attr})
+
+    def value(self, req, field):
+        value = getattr(req.context, field, None)
+        if not value:
+            value = getattr(req.context.data, field, None)
+        return value
+
+    def cached(self, keys: "Dict[str, object]") -> "Dict[str, object]":
+        found, missing = self.cache.get_many(self.model, self.attr, list(keys))
+        if missing:
+            fetched = dict.fromkeys(missing)
+            for obj in self.model.objects.filter(**{f"{self.attr}__in": [keys[key] for key in missing]}):
+                fetched[str(getattr(obj, self.attr))] = obj
+            self.cache.set_many(self.model, self.attr, fetched)
+            found.update(fetched)
+        return {key: obj for key, obj in found.items() if obj is not None and getattr(obj, "deleted", False) == self.deleted}
 
     def __call__(self, req, resp, resource, params):
-        try:
-            data = req.context.data
-            values = []
-            for field in self.fields:
-                value = getattr(req.context, field, None)
-                if not value:
-                    value = getattr(data, field, None)
-                if isinstance(value, list):
-                    if len(value):
-                        values = values + value
-                else:
-                    values.append(value)
-            if len(values) > 0:
-                objs = self.model.objects.filter(**{[f"{self.attr}__in"]: values, "deleted" :self.deleted}).all()
+        requested = {field: self.value(req, field) for field in self.fields}
+
+        keys = {}
+        for value in requested.values():
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not None:
+                    keys.setdefault(str(item), item)
+
+        index = {}
+        if keys and self.cache is not None:
+            index = self.cached(keys)
+        elif keys:
+            objs = self.model.objects.filter(**{f"{self.attr}__in": list(keys.values()), "deleted": self.deleted})
+            if self.only:
+                objs = objs.only(*self.only)
+            index = {str(getattr(obj, self.attr)): obj for obj in objs}
+
+        for field, value in requested.items():
+            field_name = field
+            if self.alias and self.alias.get(field):
+                field_name = self.alias.get(field)
+
+            if isinstance(value, list):
+                resolved = []
+                for key in dict.fromkeys(map(str, value)):
+                    obj = index.get(key)
+                    if obj is not None:
+                        resolved.append(obj)
+                setattr(req.context, field_name, resolved)
             else:
-                objs = []
-
-            for field in self.fields:
-                field_name = field
-                if self.alias and self.alias.get(field):
-                    field_name = self.alias.get(field)
-
-                value = getattr(data, field, None)
-                if isinstance(value, list):
-                    setattr(req.context, field_name, list(
-                        filter(lambda x: str(getattr(x, self.attr)) in list(map(lambda x: str(x), value)), objs)))
-                else:
-                    setattr(req.context, field_name, next(filter(lambda x: str(
-                        getattr(x, self.attr)) == str(value), objs), None))
-        except Exception as e:
-            print(e)
-            raise e
\ No newline at end of file
+                setattr(req.context, field_name, index.get(str(value)) if value is not None else None)
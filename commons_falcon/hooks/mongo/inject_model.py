@@ -1,6 +1,8 @@
 import typing
 import logging
 import stringcase as sc
+from .loader import ModelLoader
+from .model_cache import ModelCache
 
 logger = logging.getLogger(__name__)
 
@@ -11,16 +13,21 @@ except ImportError as e:
 
 class inject_model(object):
     
-    def __init__(self, model: "typing.Type[mongo.Document]", key: "str", callable: "typing.Callable", alias: "str"=None):
+    def __init__(self, model: "typing.Type[mongo.Document]", key: "str", callable: "typing.Callable", alias: "str"=None, cache: "typing.Optional[ModelCache]"=None):
+        """cache: `ModelCache` to read the document through, for rarely changing reference data"""
         self.model = model
         self.key = key
         self.callable = callable
         self.alias = alias
-        
-    def __call__(self, req, resp, resource, params):
-        value = self.callable.__call__([req, resp, resource, params])
+        self.cache = cache
+
+    def value(self, req, resp, resource, params):
+        return self.callable.__call__([req, resp, resource, params])
+
+    def inject(self, req, loader: "ModelLoader", value):
         if value is not None:
-            obj = self.model.objects.filter(**{self.key: value}).first()
+            obj = loader.load(self.model, self.key, value, self.cache)
             setattr(req, self.alias or sc.snakecase(self.model.__name__), obj)
-        
-        
\ No newline at end of file
+
+    def __call__(self, req, resp, resource, params):
+        self.inject(req, ModelLoader.of(req), self.value(req, resp, resource, params))
@@ -0,0 +1,141 @@
+import typing
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import mongoengine as mongo
+    from mongoengine.base import ComplexBaseField
+    from bson import DBRef
+except ImportError as e:
+    logger.warn("mongoengine module not found")
+
+
+class ModelLoader(object):
+    """Request-scoped batching loader with an identity map
+
+    Values are queued with `prime` and fetched with one `$in` query per
+    (model, key) on `dispatch`; `load` answers from the identity map and
+    only queries for what is still missing. Lookups primed with a `ModelCache`
+    are read through it first. Shared through `req.context`
+    by `inject_model`, `BatchInject` and handlers (`ModelLoader.of(req)`).
+    """
+
+    CONTEXT_KEY = "model_loader"
+
+    def __init__(self):
+        self.identity_map: "typing.Dict[typing.Tuple, typing.Dict[str, typing.Any]]" = {}
+        self.pending: "typing.Dict[typing.Tuple, typing.Dict[str, typing.Any]]" = {}
+        self.caches: "typing.Dict[typing.Tuple, typing.Any]" = {}
+        self.queries = 0
+
+    @classmethod
+    def of(cls, req) -> "ModelLoader":
+        return req.context.setdefault(cls.CONTEXT_KEY, cls())
+
+    @staticmethod
+    def batchable(model: "typing.Type[mongo.Document]", key: str) -> bool:
+        """Whether results can be matched back to values of `key`: a path of
+        plain or reference fields, not a query operator nor a list/dict field
+        """
+        document = model
+        for part in key.split("__"):
+            if part == "pk":
+                part = document._meta.get("id_field", "id")
+            field = getattr(document, "_fields", {}).get(part)
+            if field is None or isinstance(field, ComplexBaseField):
+                return False
+            document = field.document_type if isinstance(field, mongo.EmbeddedDocumentField) else None
+        return True
+
+    @staticmethod
+    def identity(value) -> str:
+        """Lookup key of a value, references compare by primary key"""
+        if isinstance(value, mongo.Document):
+            value = value.pk
+        elif isinstance(value, DBRef):
+            value = value.id
+        return str(value)
+
+    @classmethod
+    def key_of(cls, obj, key: str) -> str:
+        for part in key.split("__"):
+            obj = getattr(obj, part, None)
+        return cls.identity(obj)
+
+    def prime(self, model: "typing.Type[mongo.Document]", key: str, values: "typing.Iterable", cache=None):
+        if cache is not None and self.batchable(model, key):
+            self.caches[(model, key)] = cache
+        loaded = self.identity_map.get((model, key), {})
+        pending = self.pending.setdefault((model, key), {})
+        for value in values:
+            if value is not None and self.identity(value) not in loaded:
+                pending.setdefault(self.identity(value), value)
+
+    def dispatch(self):
+        pending, self.pending = self.pending, {}
+        for (model, key), values in pending.items():
+            if not values:
+                continue
+            loaded = self.identity_map.setdefault((model, key), {})
+            if self.batchable(model, key):
+                cache = self.caches.get((model, key))
+                if cache is not None:
+                    found, missing = cache.get_many(model, key, list(values))
+                    loaded.update(found)
+                    values = {value: values[value] for value in missing}
+                    if not values:
+                        continue
+
+                self.queries += 1
+                fetched = {}
+                for obj in model.objects.filter(**{f"{key}__in": list(values.values())}):
+                    fetched.setdefault(self.key_of(obj, key), obj)
+                for value in values:
+                    fetched.setdefault(value, None)
+                    loaded.setdefault(value, fetched[value])
+                if cache is not None:
+                    cache.set_many(model, key, fetched)
+            else:
+                for value_key, value in values.items():
+                    self.queries += 1
+                    loaded[value_key] = model.objects.filter(**{key: value}).first()
+
+    def load(self, model: "typing.Type[mongo.Document]", key: str, value, cache=None):
+        if value is None:
+            return None
+        loaded = self.identity_map.get((model, key), {})
+        if self.identity(value) not in loaded:
+            self.prime(model, key, [value], cache)
+            self.dispatch()
+            loaded = self.identity_map[(model, key)]
+        return loaded[self.identity(value)]
+
+    def load_many(self, model: "typing.Type[mongo.Document]", key: str, values: "typing.Iterable", cache=None) -> "typing.List":
+        values = list(values)
+        self.prime(model, key, values, cache)
+        self.dispatch()
+        loaded = self.identity_map.get((model, key), {})
+        return [loaded.get(self.identity(value)) if value is not None else None for value in values]
+
+
+class BatchInject(object):
+    """Run several `inject_model` hooks with one query per model
+
+    @falcon.before(BatchInject(inject_model(User, "id", ...), inject_model(Account, "id", ...)))
+    """
+
+    def __init__(self, *injects):
+        self.injects = injects
+
+    def __call__(self, req, resp, resource, params):
+        loader = ModelLoader.of(req)
+        values = []
+        for inject in self.injects:
+            value = inject.value(req, resp, resource, params)
+            values.append(value)
+            loader.prime(inject.model, inject.key, [value], inject.cache)
+        loader.dispatch()
+
+        for inject, value in zip(self.injects, values):
+            inject.inject(req, loader, value)
@@ -0,0 +1,225 @@
+import os
+import time
+import typing
+import logging
+import threading
+from ...auth import TTLCache
+from .loader import ModelLoader
+
+logger = logging.getLogger(__name__)
+
+try:
+    import bson
+    import mongoengine as mongo
+    from mongoengine import signals
+except ImportError as e:
+    logger.warn("mongoengine module not found")
+
+
+class ModelCache(object):
+    """Opt-in read-through cache of documents for `inject_model` and `InjectModels`
+
+    Documents are stored BSON encoded in an in-process LRU in front of Redis,
+    for `model_ttls[model.__name__]` (default `ttl`) seconds; lookups that
+    found nothing are cached for `negative_ttl`. Saving or deleting a
+    document (mongoengine `post_save`/`post_delete`, needs blinker) drops its
+    entries locally and in Redis, and publishes them on `channel` so the
+    other workers drop their local copies. Bulk `QuerySet.update` bypasses
+    the signals, such entries only expire.
+    """
+
+    def __init__(
+        self,
+        redis_client: "typing.Optional[typing.Any]" = None,
+        ttl: int = 300,
+        model_ttls: "typing.Optional[typing.Dict[str, int]]" = None,
+        negative_ttl: int = 5,
+        maxsize: int = 10000,
+        key_prefix: str = "commons_falcon:model:",
+        channel: str = "commons_falcon:model:invalidate",
+    ) -> None:
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.model_ttls = model_ttls or {}
+        self.negative_ttl = negative_ttl
+        self.key_prefix = key_prefix
+        self.channel = channel
+        self.__cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.__keys: "typing.Dict[type, typing.Set[str]]" = {}
+        self.__lock = threading.Lock()
+        self.__pid = None
+
+    def ttl_for(self, model: "typing.Type[mongo.Document]") -> int:
+        return self.model_ttls.get(model.__name__, self.ttl)
+
+    def cache_key(self, model: "typing.Type[mongo.Document]", key: str, value) -> str:
+        return f"{self.key_prefix}{model._get_collection_name()}:{key}:{ModelLoader.identity(value)}"
+
+    def register(self, model: "typing.Type[mongo.Document]", key: str) -> None:
+        """Track `key` lookups of `model` so that changes to a document invalidate them"""
+        keys = self.__keys.get(model)
+        if keys is not None and key in keys:
+            return
+
+        with self.__lock:
+            if model not in self.__keys:
+                if signals.signals_available:
+                    signals.pre_save.connect(self.__on_pre_save, sender=model)
+                    signals.post_save.connect(self.__on_change, sender=model)
+                    signals.post_delete.connect(self.__on_change, sender=model)
+                else:
+                    logger.warning("blinker is not installed, %s entries are only invalidated by ttl", model.__name__)
+                self.__keys[model] = set()
+            self.__keys[model].add(key)
+
+    def encode(self, document: "typing.Optional[mongo.Document]") -> bytes:
+        return b"" if document is None else bson.encode(document.to_mongo())
+
+    def decode(self, model: "typing.Type[mongo.Document]", raw: bytes) -> "typing.Optional[mongo.Document]":
+        return None if not raw else model._from_son(bson.decode(raw))
+
+    def get_many(self, model: "typing.Type[mongo.Document]", key: str, values: "typing.Iterable[str]") -> "typing.Tuple[typing.Dict[str, typing.Any], typing.List[str]]":
+        """Cached documents (None for known misses) by value, and the values left to load"""
+        self.register(model, key)
+        self.start()
+
+        found, missing = {}, []
+        for value in values:
+            raw = self.__cache.get(self.cache_key(model, key, value))
+            if raw is None:
+                missing.append(value)
+            else:
+                found[value] = self.decode(model, raw)
+
+        if missing and self.redis_client is not None:
+            try:
+                cached = self.redis_client.mget([self.cache_key(model, key, value) for value in missing])
+            except Exception as e:
+                logger.error("model cache read failed: %s", e)
+                cached = [None] * len(missing)
+
+            remaining = []
+            for value, raw in zip(missing, cached):
+                if raw is None:
+                    remaining.append(value)
+                    continue
+                self.__cache.set(self.cache_key(model, key, value), raw, self.__ttl(model, raw))
+                found[value] = self.decode(model, raw)
+            missing = remaining
+
+        return found, missing
+
+    def set_many(self, model: "typing.Type[mongo.Document]", key: str, documents: "typing.Dict[str, typing.Any]") -> None:
+        """Cache documents by value, None marks a lookup that found nothing"""
+        if not documents:
+            return
+
+        entries = {self.cache_key(model, key, value): self.encode(document) for value, document in documents.items()}
+        for cache_key, raw in entries.items():
+            self.__cache.set(cache_key, raw, self.__ttl(model, raw))
+
+        if self.redis_client is not None:
+            try:
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for cache_key, raw in entries.items():
+                    ttl = self.__ttl(model, raw)
+                    if ttl > 0:
+                        pipeline.set(cache_key, raw, px=int(ttl * 1000))
+                pipeline.execute()
+            except Exception as e:
+                logger.error("model cache write failed: %s", e)
+
+    def cache_keys(self, model: "typing.Type[mongo.Document]", document: "mongo.Document") -> "typing.List[str]":
+        """Entries `document` may be cached under, one per registered lookup key"""
+        keys = []
+        for key in self.__keys.get(model, ()):
+            value = document
+            for part in key.split("__"):
+                value = getattr(value, part, None)
+            if value is not None:
+                keys.append(self.cache_key(model, key, value))
+        return keys
+
+    def invalidate(self, model: "typing.Type[mongo.Document]", document: "mongo.Document", previous: "typing.Iterable[str]" = ()) -> None:
+        """Drop the entries of `document`, and `previous` cache keys it was stored under before a change"""
+        keys = list(dict.fromkeys([*self.cache_keys(model, document), *previous]))
+        if not keys:
+            return
+
+        for cache_key in keys:
+            self.__cache.delete(cache_key)
+
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(*keys)
+                self.redis_client.publish(self.channel, "\n".join(keys))
+            except Exception as e:
+                logger.error("model cache invalidation failed: %s", e)
+
+    def start(self) -> None:
+        """Start the invalidation listener of the current process, called lazily on first lookup"""
+        if self.redis_client is None or self.__pid == os.getpid():
+            return
+
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            thread = threading.Thread(target=self.__listen, name="model-cache-invalidation", daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+
+    def clear(self) -> None:
+        self.__cache.clear()
+
+    def stats(self) -> dict:
+        return self.__cache.info()._asdict()
+
+    def __ttl(self, model, raw: bytes) -> int:
+        return self.ttl_for(model) if raw else self.negative_ttl
+
+    def __on_pre_save(self, sender, document, **kwargs) -> None:
+        """Remember the entries of the stored version when a lookup key field changes.
+
+        They are kept on the document itself, so a save that fails after this
+        signal leaves nothing behind once the document is gone.
+        """
+        document._cache_previous_keys = ()
+        if document.pk is None or getattr(document, "_created", False):
+            return
+
+        fields = {key.split("__")[0] for key in self.__keys.get(sender, ())}
+        db_fields = {sender._fields[field].db_field: field for field in fields if field in sender._fields}
+        changed = {changed.split(".")[0] for changed in document._get_changed_fields()}
+        if not changed & set(db_fields):
+            return
+
+        try:
+            stored = sender.objects(pk=document.pk).only(*db_fields.values()).no_dereference().first()
+        except Exception as e:
+            logger.error("model cache could not read the stored document: %s", e)
+            return
+        if stored is not None:
+            document._cache_previous_keys = self.cache_keys(sender, stored)
+
+    def __on_change(self, sender, document, **kwargs) -> None:
+        previous = getattr(document, "_cache_previous_keys", ())
+        document._cache_previous_keys = ()
+        self.invalidate(sender, document, previous)
+
+    def __listen(self) -> None:
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # entries written while unsubscribed may have missed an invalidation
+                self.__cache.clear()
+                for message in pubsub.listen():
+                    data = message.get("data")
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    if isinstance(data, str):
+                        for cache_key in data.split("\n"):
+                            self.__cache.delete(cache_key)
+            except Exception as e:
+                logger.error("model cache invalidation listener failed: %s", e)
+                time.sleep(1)
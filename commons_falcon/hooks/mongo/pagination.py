@@ -0,0 +1,132 @@
+import base64
+import typing
+import datetime
+import structlog
+import commons_falcon.errors as errors
+import commons_falcon.json_codec as json_codec
+
+logger = structlog.get_logger(__name__)
+
+try:
+    import mongoengine as mongo
+    from bson import ObjectId
+except ImportError as e:
+    logger.warn("mongoengine module not found")
+
+
+def _tag(value):
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _untag(value):
+    if isinstance(value, dict):
+        if "$oid" in value:
+            return ObjectId(value["$oid"])
+        if "$date" in value:
+            return datetime.datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(values: "typing.Sequence") -> str:
+    """Opaque cursor of the sort key values of the last item of a page"""
+    data = json_codec.dumps([_tag(value) for value in values])
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> "typing.List":
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json_codec.loads(data)
+        if not isinstance(values, list):
+            raise ValueError("cursor is not a list")
+        return [_untag(value) for value in values]
+    except Exception:
+        raise errors.InvalidRequestParameterError("cursor", "pagination cursor")
+
+
+class CursorPagination(object):
+    """Keyset pagination over a QuerySet, pairs with `SerializeSchema(paginated=True)`
+
+    Pages are ordered by `sort_key` then `id` and continue after the opaque
+    `cursor` of the previous page, so deep pages cost the same as the first.
+    `count` is None (no total), "exact" (`count()` of the filtered QuerySet)
+    or "estimated" (`estimated_document_count()` of the whole collection).
+    """
+
+    def __init__(
+        self,
+        sort_key: str = "id",
+        page_size: int = 20,
+        max_page_size: int = 100,
+        descending: bool = False,
+        count: "typing.Optional[str]" = None,
+    ):
+        self.sort_key = sort_key
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.descending = descending
+        self.count = count
+
+    def order_by(self) -> "typing.Tuple[str, ...]":
+        sign = "-" if self.descending else "+"
+        if self.sort_key == "id":
+            return (f"{sign}id",)
+        return (f"{sign}{self.sort_key}", f"{sign}id")
+
+    def after(self, values: "typing.List") -> "mongo.Q":
+        """Documents following the cursor, null/missing sort keys sort first ascending and last descending"""
+        operator = "lt" if self.descending else "gt"
+        if self.sort_key == "id":
+            return mongo.Q(**{f"id__{operator}": values[0]})
+
+        value, last_id = values
+        ties = mongo.Q(**{self.sort_key: value, f"id__{operator}": last_id})
+        if value is None:
+            # $gt/$lt never match null, ascending moves on to the non-null keys
+            return ties if self.descending else ties | mongo.Q(**{f"{self.sort_key}__ne": None})
+
+        following = mongo.Q(**{f"{self.sort_key}__{operator}": value}) | ties
+        if self.descending:
+            following = following | mongo.Q(**{self.sort_key: None})
+        return following
+
+    def cursor_for(self, item) -> str:
+        if self.sort_key == "id":
+            return encode_cursor([item.id])
+        return encode_cursor([getattr(item, self.sort_key), item.id])
+
+    def paginate(self, req, resp, queryset: "mongo.QuerySet", cursor: "typing.Optional[str]" = None) -> "typing.List":
+        """Set `resp.json` to the page, `resp.next_cursor`, `resp.page_size` and `resp.count`
+
+        `cursor` and the page size default to the `cursor` and `page_size` query params.
+        """
+        page_size = req.get_param_as_int("page_size", min_value=1, max_value=self.max_page_size) or self.page_size
+        cursor = cursor if cursor is not None else req.get_param("cursor")
+
+        total = None
+        if self.count == "exact":
+            total = queryset.count()
+        elif self.count == "estimated":
+            total = queryset._document._get_collection().estimated_document_count()
+
+        page = queryset.order_by(*self.order_by())
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != (1 if self.sort_key == "id" else 2):
+                raise errors.InvalidRequestParameterError("cursor", "pagination cursor")
+            page = page.filter(self.after(values))
+
+        items = list(page.limit(page_size + 1))
+        resp.next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            resp.next_cursor = self.cursor_for(items[-1])
+
+        resp.json = items
+        resp.page_size = page_size
+        resp.count = total
+        return items
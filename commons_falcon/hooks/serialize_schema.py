@@ -1,30 +1,250 @@
+import enum
 import typing
+import itertools
+import structlog
 import mongoengine as mongo
 import marshmallow_objects as ms
 import commons_falcon.errors as errors
+import commons_falcon.json_codec as json_codec
+
+logger = structlog.get_logger(__name__)
+
+# fields whose dump is a plain getter, with the type `_serialize` returns unchanged
+PLAIN_FIELDS = {
+    ms.fields.Raw: None,
+    ms.fields.String: str,
+    ms.fields.Integer: int,
+    ms.fields.Float: float,
+    ms.fields.Boolean: bool,
+}
+
+
+def compile_dumper(schema: "ms.Schema") -> "typing.Optional[typing.Callable[[typing.Any], dict]]":
+    """Dump function equivalent to `schema.dump(obj)` built from a precomputed getter table
+
+    Only schemas made of `PLAIN_FIELDS` without dump hooks, dotted attributes or
+    a custom `get_attribute` are compiled, None is returned for anything else.
+    """
+    if type(schema).get_attribute is not ms.Schema.get_attribute:
+        return None
+
+    for tag, processors in getattr(schema, "_hooks", {}).items():
+        name = tag[0] if isinstance(tag, tuple) else tag
+        if processors and name in ("pre_dump", "post_dump"):
+            return None
+
+    missing = ms.missing
+    table = []
+    for field_name, field in schema.dump_fields.items():
+        if type(field) not in PLAIN_FIELDS or getattr(field, "as_string", False):
+            return None
+        attr = field.attribute if field.attribute is not None else field_name
+        if "." in attr:
+            return None
+
+        key = field.data_key if field.data_key is not None else field_name
+        # marshmallow < 3.13 only has `default`, later versions deprecate it
+        default = field.dump_default if hasattr(field, "dump_default") else getattr(field, "default", missing)
+        native = PLAIN_FIELDS[type(field)]
+        serialize = field._serialize if native is not None else None
+        table.append((key, field_name, attr, default, native, serialize))
+
+    table = tuple(table)
+    dict_class = getattr(schema, "dict_class", dict)
+
+    def dump(obj):
+        ret = dict_class()
+        is_dict = type(obj) is dict
+        has_getitem = is_dict or hasattr(obj, "__getitem__")
+        for key, field_name, attr, default, native, serialize in table:
+            # same lookup order as marshmallow.utils.get_value
+            if is_dict:
+                value = obj.get(attr, missing)
+                if value is missing:
+                    value = getattr(obj, attr, missing)
+            elif has_getitem:
+                try:
+                    value = obj[attr]
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    value = getattr(obj, attr, missing)
+            else:
+                value = getattr(obj, attr, missing)
+
+            if value is missing:
+                value = default() if callable(default) else default
+                if value is missing:
+                    continue
+
+            if serialize is not None and value is not None and type(value) is not native:
+                value = serialize(value, field_name, obj)
+            ret[key] = value
+        return ret
+
+    return dump
+
+
+def schema_projection(schema: "ms.Schema", document: "typing.Type[mongo.Document]") -> "typing.Optional[typing.Tuple[str, ...]]":
+    """Document fields read by `schema`, None when they cannot be derived
+
+    Method/Function fields and attributes that are not document fields (e.g.
+    properties) may read anything, no projection is applied for them.
+    """
+    fields = set()
+    for field_name, field in schema.dump_fields.items():
+        if not getattr(field, "_CHECK_ATTRIBUTE", True):
+            return None
+        attr = (field.attribute or field_name).split(".", 1)[0]
+        if attr not in document._fields:
+            return None
+        fields.add(attr)
+    return tuple(sorted(fields))
+
+
+def raw_documents(queryset: "mongo.QuerySet") -> "typing.Iterator[dict]":
+    """Documents of `queryset` as pymongo dicts keyed by field name instead of db field"""
+    names = {field.db_field: name for name, field in queryset._document._fields.items()}
+    for raw in queryset.as_pymongo():
+        yield {names.get(key, key): value for key, value in raw.items()}
+
 
 class SerializeSchema(object):
 
-    def __init__(self, schema: "typing.Type[ms.Model]", paginated=False):
+    class Stream(enum.Enum):
+        JSON = "application/json"
+        NDJSON = "application/x-ndjson"
+
+    def __init__(self, schema: "typing.Type[ms.Model]", paginated=False, stream: "typing.Optional[Stream]" = None, batch_size=500, compiled=False, project=False, raw=False):
+        """stream: dump lists/QuerySets in batches of `batch_size` into `resp.stream`,
+        either as a chunked JSON array (the pagination envelope follows the data)
+        or as NDJSON (the pagination envelope goes in headers, e.g. X-Count/X-Page/X-Page-Size)
+        compiled: dump through `compile_dumper` when the schema only has plain fields
+        project: restrict QuerySets to the fields of the schema with `.only(...)`
+        raw: dump QuerySets from `as_pymongo()` dicts without building Documents,
+        references and other non-plain values are then dumped as stored (e.g. ObjectId)
+        """
         self.schema = schema
         self.paginated = paginated
+        self.stream = stream
+        self.batch_size = batch_size
+        self.compiled = compiled
+        self.project = project
+        self.raw = raw
+        self.__schema = None
+        self.__dumper = None
+        self.__projections = {}
+
+    @property
+    def schema_instance(self) -> "ms.Schema":
+        """Schema instance shared by every response of the hook"""
+        if self.__schema is None:
+            schema = self.schema()
+            if self.compiled:
+                self.__dumper = compile_dumper(schema)
+                if self.__dumper is None:
+                    logger.warn("schema has non plain fields, not compiled", schema=self.schema.__name__)
+            self.__schema = schema
+        return self.__schema
+
+    def projection(self, document: "typing.Type[mongo.Document]") -> "typing.Optional[typing.Tuple[str, ...]]":
+        if document not in self.__projections:
+            self.__projections[document] = schema_projection(self.schema_instance, document)
+        return self.__projections[document]
+
+    def prepare(self, queryset: "mongo.QuerySet") -> "typing.Iterable":
+        if self.stream is not None:
+            queryset = queryset.batch_size(self.batch_size)
+        if self.project:
+            projection = self.projection(queryset._document)
+            if projection:
+                queryset = queryset.only(*projection)
+        if self.raw:
+            return raw_documents(queryset)
+        return queryset
+
+    def dump(self, data, many=False):
+        schema = self.schema_instance
+        if self.__dumper is None:
+            return schema.dump(data, many=many)
+        if many:
+            return [self.__dumper(item) for item in data]
+        return self.__dumper(data)
 
     def __call__(self, req, resp, *args, **kwargs):
         try:
             data = resp.json
             if isinstance(data, list) or isinstance(data, mongo.QuerySet):
-                resp.json = self.schema().dump(data, many=True)
+                if isinstance(data, mongo.QuerySet):
+                    data = self.prepare(data)
+
+                if self.stream is not None:
+                    self.__stream(resp, data)
+                    return
+
+                resp.json = self.dump(data, many=True)
                 if self.paginated:
-                    resp.json = {
-                        'data': resp.json,
-                        'count': resp.count,
-                        'page': resp.page,
-                        'page_size': resp.page_size
-                    }
+                    resp.json = {'data': resp.json, **self.envelope(resp)}
             elif issubclass(data.__class__, mongo.Document):
-                resp.json = self.schema().dump(data)
+                resp.json = self.dump(data)
             elif not isinstance(data, dict):
-                resp.json = self.schema().dump(data)
+                resp.json = self.dump(data)
             
         except ms.ValidationError as err:
             raise errors.DataSerializationError(err.messages)
+
+    @staticmethod
+    def envelope(resp) -> dict:
+        """Pagination envelope, keyset (`CursorPagination`) when the handler set `resp.next_cursor`"""
+        if hasattr(resp, 'next_cursor'):
+            envelope = {'next_cursor': resp.next_cursor, 'page_size': resp.page_size}
+            if getattr(resp, 'count', None) is not None:
+                envelope['count'] = resp.count
+            return envelope
+
+        return {'count': resp.count, 'page': resp.page, 'page_size': resp.page_size}
+
+    def __batches(self, data) -> "typing.Iterator[list]":
+        items = iter(data)
+        while True:
+            batch = list(itertools.islice(items, self.batch_size))
+            if not batch:
+                return
+            yield self.dump(batch, many=True)
+
+    def __stream(self, resp, data) -> None:
+        envelope = None
+        if self.paginated:
+            envelope = self.envelope(resp)
+
+        resp.json = None
+        resp.content_type = self.stream.value
+        if self.stream == self.Stream.NDJSON:
+            for key, value in (envelope or {}).items():
+                if value is not None:
+                    resp.set_header('X-' + key.replace('_', '-').title(), str(value))
+            resp.stream = self.__ndjson(data)
+        else:
+            resp.stream = self.__json_array(data, envelope)
+
+    def __ndjson(self, data) -> "typing.Iterator[bytes]":
+        try:
+            for batch in self.__batches(data):
+                yield b"".join(json_codec.dumps(item) + b"\n" for item in batch)
+        except ms.ValidationError as err:
+            # headers are already sent, the stream can only be cut short
+            logger.error("streamed serialization failed", errors=err.messages)
+
+    def __json_array(self, data, envelope: "typing.Optional[dict]") -> "typing.Iterator[bytes]":
+        yield b'{"data":[' if envelope is not None else b"["
+        separator = b""
+        try:
+            for batch in self.__batches(data):
+                if batch:
+                    yield separator + b",".join(json_codec.dumps(item) for item in batch)
+                    separator = b","
+        except ms.ValidationError as err:
+            logger.error("streamed serialization failed", errors=err.messages)
+
+        if envelope is not None:
+            yield b"]," + json_codec.dumps(envelope)[1:]
+        else:
+            yield b"]"
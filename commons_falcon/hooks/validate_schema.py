@@ -1,6 +1,7 @@
 import typing
 import structlog
 import commons_falcon.errors as errors
+import commons_falcon.middlewares.json_middleware as json_middleware
 
 logger = structlog.get_logger(__name__)
 
@@ -36,4 +37,21 @@ class ValidateParams(object):
         try:
             req.context['params'] = self.schema(**params)
         except ms.ValidationError as err:
-            errors.SchemaValidationError(err.messages)
\ No newline at end of file
+            errors.SchemaValidationError(err.messages)
+
+
+class ValidateFields(object):
+    """Validate `req.json` against field specs compiled once per route
+
+    `specs` maps field names to `json_middleware.FieldSpec` keyword arguments,
+    all violations are raised together as a `SchemaValidationError`.
+    """
+
+    def __init__(self, specs: "typing.Dict[str, typing.Union[json_middleware.FieldSpec, dict]]"):
+        self.plan = json_middleware.ValidationPlan(specs)
+
+    def __call__(self, req, resp, resource, params):
+        values, field_errors = self.plan.run(getattr(req, "json", None) or {})
+        if field_errors:
+            raise errors.SchemaValidationError(field_errors)
+        req.context['data'] = values
@@ -0,0 +1,52 @@
+import structlog
+import json
+import uuid
+import decimal
+import datetime
+import typing
+
+logger = structlog.get_logger(__name__)
+
+__all__ = ('default', 'loads', 'dumps', 'BACKEND')
+
+try:
+    import orjson
+except ImportError as e:
+    orjson = None
+
+try:
+    from bson import ObjectId
+except ImportError as e:
+    logger.warn("bson module not found")
+    ObjectId = None
+
+
+def default(o: "typing.Any") -> "typing.Any":
+    """Encoder for types JSON has no representation of"""
+    if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+        return o.isoformat()
+    if ObjectId is not None and isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {o.__class__.__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: "typing.Union[bytes, str]") -> "typing.Any":
+        return orjson.loads(data)
+
+    def dumps(obj: "typing.Any") -> bytes:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: "typing.Union[bytes, str]") -> "typing.Any":
+        return json.loads(data)
+
+    def dumps(obj: "typing.Any") -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
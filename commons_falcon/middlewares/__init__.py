@@ -1,4 +1,6 @@
-from .json_middleware import JsonMiddleware
+from .json_middleware import JsonMiddleware, JsonRequest
 from .auth_middleware import SimpleAuthMiddleware
 from .elastic_search_logging_middleware import ESLoggingMiddleware
-from .request_id import configure_falcon_request_id_middleware
\ No newline at end of file
+from .request_id import configure_falcon_request_id_middleware
+from .compression_middleware import CompressionMiddleware
+from .etag_middleware import ETagMiddleware
\ No newline at end of file
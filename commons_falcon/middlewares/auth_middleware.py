@@ -1,4 +1,6 @@
 import typing
+import asyncio
+import inspect
 import falcon
 import datetime
 import commons_falcon.errors as errors
@@ -6,51 +8,109 @@ import commons_falcon.auth as auth_utils
 
 
 class SimpleAuthMiddleware(object):
-    def __init__(self, config: dict, oauth_client=None, jwt_auth_service=None):
+    def __init__(
+        self,
+        config: dict,
+        oauth_client=None,
+        jwt_auth_service=None,
+        access_token_cache: "typing.Optional[auth_utils.AccessTokenCache]" = None,
+    ):
         self.__config = config
         self.__oauth_client = oauth_client
         self.__jwt_auth_service = jwt_auth_service
+        self.__access_token_cache = access_token_cache
 
         self.__config["exempted_paths"] = self.__config.get("exempted_paths", [])
         self.__config["clients"] = self.__config.get("clients", {})
         self.__config["api_keys"] = self.__config.get("api_keys", [])
         self.__config["ip_whitelist"] = self.__config.get("ip_whitelist", [])
 
+        # compiled once, lookups on the request path do not scan the lists
+        self.__exempted_paths = frozenset(self.__config["exempted_paths"])
+        self.__api_keys = auth_utils.APIKeySet(self.__config["api_keys"])
+        self.__ip_whitelist = auth_utils.IPNetworkTrie(self.__config["ip_whitelist"])
+
     def process_request(self, req: "falcon.Request", resp: "falcon.Response") -> object:
+        if self.__authorize_preflight(req, resp):
+            return
+
+        jwt_auth = req.get_header("X-JWT")
+        if jwt_auth:
+            self.__authorize_jwt(req, self.__jwt_auth_service.verify(jwt_auth))
+            return
+
+        if self.__authorize_static(req):
+            return
+
+        auth = req.get_header("AUTHORIZATION")
+        if auth and len(auth) > 0:
+            self.__authorize_access_token(req, self.__authenticate_access_token(auth[7:]))
+            return
+
+    async def process_request_async(self, req: "falcon.Request", resp: "falcon.Response") -> object:
+        """`process_request` for `falcon.asgi`, network calls do not block the event loop.
+
+        JWTs are verified by an `auth_utils.AsyncJWTVerifyService`; the OAuth
+        client is synchronous, so bearer tokens are resolved on the default
+        executor (through the access token cache when configured).
+        """
+        if self.__authorize_preflight(req, resp):
+            return
+
+        jwt_auth = req.get_header("X-JWT")
+        if jwt_auth:
+            result = self.__jwt_auth_service.verify(jwt_auth)
+            if inspect.isawaitable(result):
+                result = await result
+            self.__authorize_jwt(req, result)
+            return
+
+        if self.__authorize_static(req):
+            return
+
+        auth = req.get_header("AUTHORIZATION")
+        if auth and len(auth) > 0:
+            oauth_user = await asyncio.get_running_loop().run_in_executor(
+                None, self.__authenticate_access_token, auth[7:]
+            )
+            self.__authorize_access_token(req, oauth_user)
+            return
+
+    def __authorize_preflight(self, req: "falcon.Request", resp: "falcon.Response") -> bool:
         self.request_initate_time = datetime.datetime.utcnow()
 
         if req.method == "OPTIONS":
             resp.status = falcon.HTTP_200
             resp.complete = True
-            return
-        
-        jwt_auth = req.headers.get("X-JWT", None)
-        if jwt_auth:
-            verification_error, token = self.__jwt_auth_service.verify(jwt_auth)
-            if verification_error:
-                error_mapping = {
-                    auth_utils.JWTVerificationError.EXPIRED: errors.InvalidJWTError,
-                    auth_utils.JWTVerificationError.INVALID: errors.UnAuthorizedSession,
-                    auth_utils.JWTVerificationError.INTERNAL: errors.ServiceFailureError,
-                }
-
-                raise error_mapping.get(verification_error, errors.UnAuthorizedSession)()
-
-            req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.JWT
-            req.context["authorization_payload"] = token
-            return
+            return True
+        return False
+
+    def __authorize_jwt(self, req: "falcon.Request", result: "tuple") -> None:
+        verification_error, token = result
+        if verification_error:
+            error_mapping = {
+                auth_utils.JWTVerificationError.EXPIRED: errors.InvalidJWTError,
+                auth_utils.JWTVerificationError.INVALID: errors.UnAuthorizedSession,
+                auth_utils.JWTVerificationError.INTERNAL: errors.ServiceFailureError,
+            }
+
+            raise error_mapping.get(verification_error, errors.UnAuthorizedSession)()
 
-        if req.access_route[0] in self.__config.get("ip_whitelist"):
+        req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.JWT
+        req.context["authorization_payload"] = token
+
+    def __authorize_static(self, req: "falcon.Request") -> bool:
+        if req.access_route[0] in self.__ip_whitelist:
             req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.IP_WHITELIST
-            return
+            return True
 
-        if req.headers.get("X-API-KEY") in self.__config.get("api_keys"):
+        if req.get_header("X-API-KEY") in self.__api_keys:
             req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.API_KEY
-            return
+            return True
 
         client_id, client_secret = (
-            req.headers.get("CLIENT-ID") or req.headers.get("CLIENTID"),
-            req.headers.get("CLIENT-SECRET") or req.headers.get("CLIENTSECRET"),
+            req.get_header("CLIENT-ID") or req.get_header("CLIENTID"),
+            req.get_header("CLIENT-SECRET") or req.get_header("CLIENTSECRET"),
         )
         if (
             (self.__config.get("clients") or {}).get(client_id) == client_secret
@@ -58,26 +118,40 @@ class SimpleAuthMiddleware(object):
             and client_secret is not None
         ):
             req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.CLIENT_SECRET
-            return
+            return True
 
-        auth = req.headers.get("AUTHORIZATION", None)
-        if auth and len(auth) > 0:
-            auth_token_string = auth[7:]
-            error, token = self.__oauth_client.introspection(
-                None, None, auth_token_string, "access_token"
-            )
-            if error:
-                raise errors.UnAuthorizedSession()
+        return False
+
+    def __authorize_access_token(self, req: "falcon.Request", oauth_user: "typing.Optional[dict]") -> None:
+        if oauth_user is None:
+            raise errors.UnAuthorizedSession()
 
-            error, oauth_user = self.__oauth_client.get_user(
-                auth_token=auth_token_string
+        setattr(req, "user", oauth_user)
+        req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.ACCESS_TOKEN
+
+    def __authenticate_access_token(self, auth_token_string: str) -> "typing.Optional[dict]":
+        if self.__access_token_cache is not None:
+            return self.__access_token_cache.get_or_load(
+                auth_token_string, self.__load_oauth_user
             )
-            if error or not oauth_user.get("username"):
-                raise errors.UnAuthorizedSession()
 
-            setattr(req, "user", oauth_user)
-            req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.ACCESS_TOKEN
-            return
+        oauth_user, _ = self.__load_oauth_user(auth_token_string)
+        return oauth_user
+
+    def __load_oauth_user(self, auth_token_string: str) -> "tuple":
+        error, token = self.__oauth_client.introspection(
+            None, None, auth_token_string, "access_token"
+        )
+        if error:
+            return None, None
+
+        error, oauth_user = self.__oauth_client.get_user(
+            auth_token=auth_token_string
+        )
+        if error or not oauth_user.get("username"):
+            return None, token
+
+        return oauth_user, token
 
     def process_resource(
         self, req: "falcon.Request", resp: "falcon.Response", resource, params
@@ -100,7 +174,7 @@ class SimpleAuthMiddleware(object):
             return
 
         if request_authorization_scheme is None:
-            if req.uri_template not in self.__config.get("exempted_paths"):
+            if req.uri_template not in self.__exempted_paths:
                 raise errors.UnAuthorizedSession()
 
             req.context["authorization_scheme"] = auth_utils.AuthorizationScheme.EXEMPTED_PATH
@@ -115,5 +189,13 @@ class SimpleAuthMiddleware(object):
         if request_authorization_scheme not in resource_authorization_schemes:
             raise errors.ForbiddenError()
 
+    async def process_resource_async(
+        self, req: "falcon.Request", resp: "falcon.Response", resource, params
+    ):
+        self.process_resource(req, resp, resource, params)
+
     def process_response(self, req, resp, resource, params):
         pass
+
+    async def process_response_async(self, req, resp, resource, params):
+        pass
@@ -0,0 +1,146 @@
+import structlog
+import gzip
+import hashlib
+import typing
+import commons_falcon.auth as auth_utils
+
+logger = structlog.get_logger(__name__)
+
+try:
+    import falcon
+except ImportError as e:
+    logger.warn("falcon module not found")
+
+try:
+    import brotli
+except ImportError as e:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError as e:
+    zstandard = None
+
+
+def _gzip(data: bytes, level: int) -> bytes:
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data: bytes, level: int) -> bytes:
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data: bytes, level: int) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# encoding: (compress, min level, max level, default level)
+CODECS = {"gzip": (_gzip, 1, 9, 6)}
+if brotli is not None:
+    CODECS["br"] = (_brotli, 0, 11, 5)
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd, 1, 22, 3)
+
+
+class CompressionMiddleware:
+    """Compress response bodies negotiated through `Accept-Encoding`
+
+    Responses go out in the first of `encodings` the client accepts with the
+    highest q-value, bodies smaller than `min_size` bytes are sent as is.
+    Levels are resolved from the resource's `compression_level` attribute, then
+    `route_levels` (by route template), then `levels`; each may be an int for
+    all encodings or a dict by encoding, a level of 0 disables compression.
+    With `reuse_cached`, bodies replayed by the falcon-caching middleware
+    (`req.context.cached`) reuse their previously compressed bytes.
+
+    The middleware must be listed before `JsonMiddleware` and the cache
+    middleware so its `process_response` runs on the final body.
+    """
+
+    def __init__(
+        self,
+        min_size: "int" = 1024,
+        levels: "typing.Union[int, typing.Dict[str, int], None]" = None,
+        route_levels: "typing.Optional[typing.Dict[str, typing.Union[int, typing.Dict[str, int]]]]" = None,
+        encodings: "typing.Sequence[str]" = ("br", "zstd", "gzip"),
+        reuse_cached: "bool" = True,
+        cache_size: "int" = 256,
+        cache_ttl: "int" = 600,
+    ):
+        self.min_size = min_size
+        self.levels = levels
+        self.route_levels = route_levels or {}
+        self.encodings = tuple(encoding for encoding in encodings if encoding in CODECS)
+        self.reuse_cached = reuse_cached
+        self.__compressed = auth_utils.TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def negotiate(self, accept_encoding: "typing.Optional[str]") -> "typing.Optional[str]":
+        if not accept_encoding:
+            return None
+
+        accepted = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+
+        wildcard = accepted.get("*", 0.0)
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, wildcard)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def level(self, req: "falcon.Request", resource, encoding: "str") -> "int":
+        level = getattr(resource, "compression_level", None)
+        if level is None:
+            level = self.route_levels.get(req.uri_template, self.levels)
+        if isinstance(level, dict):
+            level = level.get(encoding)
+
+        _, min_level, max_level, default_level = CODECS[encoding]
+        if level is None:
+            return default_level
+        if level == 0:
+            return 0
+        return min(max(level, min_level), max_level)
+
+    def process_response(self, req: "falcon.Request", resp: "falcon.Response", resource, req_succeeded):
+        if req.method == "HEAD" or resp.stream is not None or resp.get_header("Content-Encoding"):
+            return
+
+        body = resp.text if resp.text is not None else resp.data
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if not body or len(body) < self.min_size:
+            return
+
+        resp.append_header("Vary", "Accept-Encoding")
+        encoding = self.negotiate(req.get_header("Accept-Encoding"))
+        if encoding is None:
+            return
+
+        level = self.level(req, resource, encoding)
+        if level == 0:
+            return
+
+        compress = CODECS[encoding][0]
+        if self.reuse_cached and getattr(req.context, "cached", False):
+            key = (encoding, level, hashlib.blake2b(body, digest_size=16).digest())
+            compressed = self.__compressed.get_or_load(key, lambda: compress(body, level))
+        else:
+            compressed = compress(body, level)
+
+        if len(compressed) >= len(body):
+            return
+
+        resp.text = None
+        resp.data = compressed
+        resp.set_header("Content-Encoding", encoding)
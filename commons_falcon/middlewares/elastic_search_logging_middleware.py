@@ -2,7 +2,15 @@ import structlog
 import traceback
 import falcon
 import json
+import os
+import enum
+import time
+import atexit
+import typing
+import threading
+import collections
 from datetime import datetime
+from commons_falcon.circuit_breaker import CircuitBreaker
 
 logger = structlog.get_logger(__name__)
 
@@ -17,6 +25,408 @@ except ImportError as e:
     logger.warn("flatten_json module not found")
 
 
+def generate_document_id() -> int:
+    return int(datetime.utcnow().timestamp() * 1000000)
+
+
+class BulkRejected(Exception):
+    """Raised when `_bulk` rejected documents with a retryable status"""
+
+    def __init__(self, batch: "typing.List[tuple]"):
+        super().__init__(f"{len(batch)} documents rejected with a retryable status")
+        self.batch = batch
+
+
+class DropPolicy(enum.Enum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class ESSpool:
+    """Append-only NDJSON spool for documents Elasticsearch could not take.
+
+    Documents are appended to the open segment of the current process, which
+    is sealed once it reaches `segment_size` bytes. Sealed segments are
+    replayed oldest first and deleted once sent; when the spool grows past
+    `max_bytes` the oldest sealed segments are dropped. Segments are named
+    `<time_ns>-<pid>`, so workers sharing a directory never write to the same
+    file and segments left open by dead workers are recovered on replay.
+    """
+
+    OPEN_SUFFIX = ".open"
+    SEALED_SUFFIX = ".ndjson"
+    REPLAY_SUFFIX = ".replay"
+
+    def __init__(
+        self,
+        directory: "str",
+        segment_size: "int" = 8 * 1024 * 1024,
+        max_bytes: "int" = 512 * 1024 * 1024,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.dropped_segments = 0
+        self.skipped_lines = 0
+        self.__lock = threading.Lock()
+        self.__segment_pid = None
+        self.__segment_path = None
+        self.__segment_file = None
+        self.__segment_bytes = 0
+
+    def write(self, batch: "typing.List[tuple]") -> None:
+        data = "".join(
+            json.dumps({"_id": doc_id, "doc": doc}, default=str) + "\n"
+            for doc_id, doc in batch
+        ).encode("utf-8")
+
+        with self.__lock:
+            if self.__segment_file is None or self.__segment_pid != os.getpid():
+                # a forked worker must not append to its parent's segment
+                self.__segment_pid = os.getpid()
+                self.__segment_path = os.path.join(
+                    self.directory, f"{time.time_ns()}-{os.getpid()}{self.OPEN_SUFFIX}"
+                )
+                self.__segment_file = open(self.__segment_path, "ab")
+                self.__segment_bytes = 0
+
+            self.__segment_file.write(data)
+            self.__segment_file.flush()
+            self.__segment_bytes += len(data)
+            if self.__segment_bytes >= self.segment_size:
+                self.__seal()
+                self.__enforce_max_bytes()
+
+    def seal(self) -> None:
+        with self.__lock:
+            self.__seal()
+
+    def segments(self, suffix: "str" = SEALED_SUFFIX) -> "typing.List[str]":
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(suffix))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def replay(
+        self,
+        send: "typing.Callable[[typing.List[tuple]], None]",
+        batch_size: "int" = 500,
+        max_segments: "typing.Optional[int]" = None,
+    ) -> bool:
+        """Send sealed segments through `send`, False if a send failed.
+
+        At most `max_segments` segments are sent per call, all of them when
+        None.
+
+        A segment is claimed by renaming it, so concurrent replayers never send
+        the same segment. Documents keep their `_id`, resending a partially
+        replayed segment overwrites instead of duplicating. Lines that do not
+        decode (e.g. torn by a worker killed mid-write) are skipped and counted
+        in `skipped_lines`.
+        """
+        self.seal()
+        self.__recover()
+
+        for path in self.segments()[:max_segments]:
+            claimed = f"{path}.{os.getpid()}{self.REPLAY_SUFFIX}"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+
+            try:
+                with open(claimed, "rb") as segment:
+                    batch = []
+                    for line in segment:
+                        try:
+                            entry = json.loads(line)
+                            batch.append((entry["_id"], entry["doc"]))
+                        except (ValueError, TypeError, KeyError):
+                            self.skipped_lines += 1
+                            logger.warn("es spool skipped undecodable line", segment=path)
+                            continue
+                        if len(batch) >= batch_size:
+                            send(batch)
+                            batch = []
+                    if batch:
+                        send(batch)
+            except Exception as e:
+                os.rename(claimed, path)
+                logger.error("es spool replay failed", segment=path, error=str(e))
+                return False
+
+            os.remove(claimed)
+        return True
+
+    def __seal(self) -> None:
+        if self.__segment_file is None:
+            return
+
+        self.__segment_file.close()
+        os.rename(self.__segment_path, self.__segment_path[: -len(self.OPEN_SUFFIX)] + self.SEALED_SUFFIX)
+        self.__segment_file = None
+        self.__segment_path = None
+
+    def __enforce_max_bytes(self) -> None:
+        segments = self.segments()
+        sizes = [os.path.getsize(path) for path in segments]
+        total = sum(sizes)
+        for path, size in zip(segments, sizes):
+            if total <= self.max_bytes:
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.dropped_segments += 1
+            logger.warn("es spool full, dropped segment", segment=path)
+
+    def __recover(self) -> None:
+        """Seal open segments and release claimed ones left by dead workers"""
+        for suffix in (self.OPEN_SUFFIX, self.REPLAY_SUFFIX):
+            for path in self.segments(suffix):
+                try:
+                    if suffix == self.REPLAY_SUFFIX:
+                        # <time_ns>-<pid>.ndjson.<replayer pid>.replay
+                        sealed, pid = path[: -len(suffix)].rsplit(".", 1)
+                        if not sealed.endswith(self.SEALED_SUFFIX):
+                            continue
+                    else:
+                        # <time_ns>-<pid>.open
+                        sealed = path[: -len(suffix)] + self.SEALED_SUFFIX
+                        pid = path[: -len(suffix)].rsplit("-", 1)[1]
+                    pid = int(pid)
+                except (IndexError, ValueError):
+                    # not a segment of ours
+                    continue
+
+                if pid == os.getpid() or self.__alive(pid):
+                    continue
+
+                try:
+                    os.rename(path, sealed)
+                except FileNotFoundError:
+                    continue
+
+    @staticmethod
+    def __alive(pid: "int") -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+class BulkShipper:
+    """Ships documents to Elasticsearch from a bounded in-memory queue.
+
+    A daemon thread drains the queue through the `_bulk` API whenever
+    `batch_size` documents are pending or `flush_interval` seconds have passed.
+    When the queue is full `drop_policy` decides which document is lost.
+    Every lost document is counted in `dropped`.
+    Pending documents are flushed at interpreter exit.
+
+    Requests go through `breaker`; while Elasticsearch is failing batches are
+    written to `spool` (when given) without waiting on the cluster, and the
+    spool is replayed every `replay_interval` seconds once it recovers.
+    Replay sends `replay_segments` segments between two live batches, so a
+    large backlog never holds up fresh documents until the queue overflows.
+    """
+
+    def __init__(
+        self,
+        es: "esc.Elasticsearch",
+        index: "str",
+        queue_size: "int" = 10000,
+        batch_size: "int" = 500,
+        flush_interval: "float" = 1.0,
+        drop_policy: "DropPolicy" = DropPolicy.DROP_OLDEST,
+        breaker: "typing.Optional[CircuitBreaker]" = None,
+        spool: "typing.Optional[ESSpool]" = None,
+        replay_interval: "float" = 30,
+        replay_segments: "int" = 1,
+    ):
+        self.es = es
+        self.index = index
+        self.breaker = breaker or CircuitBreaker()
+        self.spool = spool
+        self.replay_interval = replay_interval
+        self.replay_segments = replay_segments
+        self.__replayed_at = 0.0
+        self.__replay_pending = False
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.__queue: "typing.Deque[tuple]" = collections.deque()
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__pid = None
+        atexit.register(self.close)
+
+    def put(self, doc: "dict") -> None:
+        self.__start()
+        with self.__condition:
+            if len(self.__queue) >= self.queue_size:
+                self.dropped += 1
+                if self.drop_policy == DropPolicy.DROP_NEWEST:
+                    return
+                self.__queue.popleft()
+
+            self.__queue.append((generate_document_id(), doc))
+            if len(self.__queue) >= self.batch_size:
+                self.__condition.notify()
+
+    def flush(self) -> None:
+        while True:
+            batch = self.__take()
+            if not batch:
+                return
+            self.ship(batch)
+
+    def close(self) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.flush()
+
+    def ship(self, batch: "typing.List[tuple]") -> None:
+        if self.breaker.allow():
+            try:
+                self.send(batch)
+                self.breaker.record_success()
+                return
+            except BulkRejected as e:
+                self.breaker.record_failure()
+                logger.error("es bulk documents need a retry", error=str(e), total=len(batch))
+                batch = e.batch
+                if self.spool is None:
+                    self.__requeue(batch)
+                    return
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.error("es bulk request failed", error=str(e), total=len(batch))
+
+        if self.spool is None:
+            self.drop(batch, "es bulk batch dropped")
+            return
+
+        try:
+            self.spool.write(batch)
+        except Exception as e:
+            logger.error("es spool write failed", error=str(e), total=len(batch))
+            self.drop(batch, "es bulk batch dropped")
+
+    def drop(self, batch: "typing.List[tuple]", reason: "str") -> None:
+        with self.__condition:
+            self.dropped += len(batch)
+        logger.warn(reason, total=len(batch), dropped=self.dropped)
+
+    def send(self, batch: "typing.List[tuple]") -> None:
+        """Index `batch` with one `_bulk` request.
+
+        Raises on transport errors, and `BulkRejected` with the documents the
+        cluster refused with 429 or 5xx. Documents refused with any other
+        status will never index and are dropped.
+        """
+        actions = []
+        for doc_id, doc in batch:
+            actions.append({"index": {"_index": self.index, "_id": doc_id}})
+            actions.append(doc)
+
+        response = self.es.bulk(body=actions)
+        if not response.get("errors"):
+            return
+
+        retryable, rejected = [], []
+        for entry, item in zip(batch, response.get("items", [])):
+            result = item.get("index", {})
+            if not result.get("error"):
+                continue
+            status = result.get("status", 0)
+            if status == 429 or status >= 500:
+                retryable.append(entry)
+            else:
+                rejected.append(entry)
+
+        if rejected:
+            self.drop(rejected, "es bulk documents rejected")
+        if retryable:
+            raise BulkRejected(retryable)
+
+    def replay(self) -> None:
+        self.__replayed_at = time.monotonic()
+        self.__replay_pending = False
+        if self.spool is None or not self.breaker.allow():
+            return
+
+        def send(batch):
+            try:
+                self.send(batch)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+
+        if self.spool.replay(send, self.batch_size, self.replay_segments):
+            self.__replay_pending = bool(self.spool.segments())
+
+    def __requeue(self, batch: "typing.List[tuple]") -> None:
+        with self.__condition:
+            room = max(0, self.queue_size - len(self.__queue))
+            self.__queue.extendleft(reversed(batch[:room]))
+            self.dropped += len(batch) - min(room, len(batch))
+
+    def __take(self) -> "typing.List[tuple]":
+        with self.__condition:
+            count = min(self.batch_size, len(self.__queue))
+            return [self.__queue.popleft() for _ in range(count)]
+
+    def __start(self) -> None:
+        # threads do not survive a fork, start one per worker process
+        if self.__pid == os.getpid():
+            return
+
+        with self.__condition:
+            if self.__pid == os.getpid():
+                return
+            thread = threading.Thread(target=self.__run, name="es-bulk-shipper", daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+
+    def __run(self) -> None:
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            with self.__condition:
+                while not self.__closed and len(self.__queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                if self.__closed:
+                    return
+
+            batch = self.__take()
+            if batch:
+                self.ship(batch)
+
+            if (
+                self.spool is not None
+                and (
+                    self.__replay_pending
+                    or time.monotonic() - self.__replayed_at >= self.replay_interval
+                )
+            ):
+                try:
+                    self.replay()
+                except Exception as e:
+                    # the thread must outlive a broken spool, or logs pile up unshipped
+                    logger.error("es spool replay failed", error=str(e))
+
+
 class ESLoggingMiddleware:
     def __init__(
         self,
@@ -27,7 +437,22 @@ class ESLoggingMiddleware:
         scheme: "str" = "http",
         request_timeout: "int" = 5,
         index: "str" = None,
+        bulk: "bool" = True,
+        queue_size: "int" = 10000,
+        batch_size: "int" = 500,
+        flush_interval: "float" = 1.0,
+        drop_policy: "DropPolicy" = DropPolicy.DROP_OLDEST,
+        spool_dir: "str" = None,
+        spool_segment_size: "int" = 8 * 1024 * 1024,
+        spool_max_bytes: "int" = 512 * 1024 * 1024,
+        failure_threshold: "int" = 5,
+        reset_timeout: "float" = 30,
     ):
+        """`spool_dir` enables the on-disk spool of the bulk shipper.
+
+        Without bulk shipping the circuit breaker still applies, documents are
+        dropped without touching Elasticsearch while the circuit is open.
+        """
         es = esc.Elasticsearch(
             [host],
             port=port,
@@ -37,9 +462,33 @@ class ESLoggingMiddleware:
             max_retries=1,
         )
 
-        self.logger = lambda doc: es.index(
-            index=index, id=int(datetime.utcnow().timestamp() * 1000000), body=doc
-        )
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.shipper = None
+        if bulk:
+            self.shipper = BulkShipper(
+                es,
+                index,
+                queue_size=queue_size,
+                batch_size=batch_size,
+                flush_interval=flush_interval,
+                drop_policy=drop_policy,
+                breaker=self.breaker,
+                spool=ESSpool(spool_dir, spool_segment_size, spool_max_bytes) if spool_dir else None,
+            )
+            self.logger = self.shipper.put
+        else:
+            self.logger = lambda doc: self.__index(es, index, doc)
+
+    def __index(self, es: "esc.Elasticsearch", index: "str", doc: "dict") -> None:
+        if not self.breaker.allow():
+            return
+
+        try:
+            es.index(index=index, id=generate_document_id(), body=doc)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
 
     def process_request(self, req, resp):
         setattr(req, "start_time", datetime.utcnow())
@@ -0,0 +1,90 @@
+import structlog
+import zlib
+import typing
+
+logger = structlog.get_logger(__name__)
+
+try:
+    import falcon
+except ImportError as e:
+    logger.warn("falcon module not found")
+
+try:
+    import xxhash
+except ImportError as e:
+    xxhash = None
+
+
+def body_etag(body: bytes) -> str:
+    """Weak ETag of a serialized body from a fast non-cryptographic hash"""
+    if xxhash is not None:
+        return 'W/"{}"'.format(xxhash.xxh3_64_hexdigest(body))
+    return 'W/"{:08x}{:08x}{:x}"'.format(zlib.crc32(body), zlib.adler32(body), len(body))
+
+
+def version_etag(version: "typing.Any") -> str:
+    return body_etag("v:{}".format(version).encode("utf-8"))
+
+
+def etag_matches(if_none_match: "typing.Optional[str]", etag: str) -> bool:
+    """Weak comparison of `etag` against an `If-None-Match` header"""
+    if not if_none_match:
+        return False
+
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class ETagMiddleware:
+    """Set `ETag` on responses and answer matching `If-None-Match` with 304
+
+    By default the ETag hashes the final serialized body. Responders decorated
+    with the `ETagVersion` hook derive it from a cheap version key instead, and
+    a matching request is answered before the responder and its other hooks
+    (e.g. `SerializeSchema`) run at all.
+
+    List it after `CompressionMiddleware`, so the ETag is computed on the
+    uncompressed body, and before `JsonMiddleware`, which renders the body in
+    its `process_response` (listed after it, no ETag is set).
+    """
+
+    def __init__(self, methods: "typing.Iterable[str]" = ("GET", "HEAD")):
+        self.methods = frozenset(methods)
+
+    def process_response(self, req: "falcon.Request", resp: "falcon.Response", resource, req_succeeded):
+        if (
+            not req_succeeded
+            or req.method not in self.methods
+            or resp.status not in (falcon.HTTP_200, 200)
+            or resp.stream is not None
+        ):
+            return
+
+        etag = req.context.get("etag")
+        if etag is None:
+            body = resp.text if resp.text is not None else resp.data
+            if body is None:
+                return
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            etag = body_etag(body)
+
+        if etag_matches(req.get_header("If-None-Match"), etag):
+            self.not_modified(resp, etag)
+        else:
+            resp.set_header("ETag", etag)
+
+    @staticmethod
+    def not_modified(resp: "falcon.Response", etag: str) -> None:
+        resp.status = falcon.HTTP_304
+        resp.text = None
+        resp.data = None
+        resp.set_header("ETag", etag)
@@ -3,35 +3,182 @@ import json
 import re
 import falcon
 import six
-from datetime import datetime
+import typing
+import functools
+import commons_falcon.json_codec as json_codec
 
 
 logger = structlog.get_logger(__name__)
 
-bs = None
-try:
-    import bson.json_utils as bs
-except ImportError as e:
-    logger.error(e)
-
-if bs is None:
-    try:
-        import bson as bs
-    except ImportError as e:
-        logger.error(e)
-
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, o):
-        if isinstance(o, datetime):
-            return o.isoformat()
-        return json.JSONEncoder.default(self, o)
+        try:
+            return json_codec.default(o)
+        except TypeError:
+            return json.JSONEncoder.default(self, o)
+
+
+MISSING = object()
+
+
+class FieldSpec(object):
+    """Validators of one JSON field compiled once, see `JsonMiddleware.validate`
+
+    Regexes are precompiled and choices frozen into a set, `check` returns every
+    violation of a value instead of stopping at the first one.
+    """
+
+    __slots__ = ("field", "dtype", "default", "min", "max", "match", "choices")
+
+    def __init__(
+        self,
+        field,
+        dtype=None,
+        default=MISSING,
+        min=None,
+        max=None,
+        match=None,
+        choices=None,
+    ):
+        self.field = field
+        self.dtype = dtype
+        self.default = default
+        self.min = min
+        self.max = max
+        self.match = re.compile(match) if isinstance(match, str) else match
+        self.choices = None
+        if choices:
+            try:
+                self.choices = frozenset(choices)
+            except TypeError:
+                self.choices = tuple(choices)
+
+    def check(self, value) -> "typing.List[str]":
+        errors = []
+        value_type = type(value)
+
+        if self.dtype and value_type is not self.dtype and not (
+            self.dtype is str and value_type in six.string_types
+        ):
+            errors.append(
+                "Data type for '{}' is '{}' but should be '{}'".format(
+                    self.field, value_type.__name__, self.dtype.__name__
+                )
+            )
+
+        if value_type in six.string_types:
+            if self.min and len(value) < self.min:
+                errors.append("Minimum length for '{}' is '{}'".format(self.field, self.min))
+            if self.max and len(value) > self.max:
+                errors.append("Maximum length for '{}' is '{}'".format(self.field, self.max))
+        elif value_type in (int, float):
+            if self.min and value < self.min:
+                errors.append("Minimum value for '{}' is '{}'".format(self.field, self.min))
+            if self.max and value > self.max:
+                errors.append("Maximum value for '{}' is '{}'".format(self.field, self.max))
+
+        if self.match is not None and (
+            value_type not in six.string_types or not self.match.match(value)
+        ):
+            errors.append(
+                "'{}' does not match Regex: {}".format(self.field, self.match.pattern)
+            )
+
+        if self.choices is not None:
+            try:
+                allowed = value in self.choices
+            except TypeError:
+                allowed = False
+            if not allowed:
+                errors.append("{} must be one of {}".format(self.field, sorted(self.choices, key=str)))
+
+        return errors
+
+
+# specs compiled by `JsonMiddleware.validate`, keyed by its arguments
+_field_specs: "typing.Dict[tuple, FieldSpec]" = {}
+
+
+class ValidationPlan(object):
+    """Field specs of a route compiled once and run in a single pass
+
+    specs: field name to `FieldSpec` or to the keyword arguments of one,
+    a field without `default` is required.
+    """
+
+    def __init__(self, specs: "typing.Dict[str, typing.Union[FieldSpec, dict]]"):
+        self.specs = tuple(
+            spec if isinstance(spec, FieldSpec) else FieldSpec(field, **spec)
+            for field, spec in specs.items()
+        )
+
+    def run(self, data) -> "typing.Tuple[dict, typing.Dict[str, typing.List[str]]]":
+        """Validated values and the errors by field, of a parsed JSON body"""
+        values = {}
+        errors = {}
+        if not isinstance(data, dict):
+            return values, {"_schema": ["Request body must be a JSON object"]}
+
+        for spec in self.specs:
+            value = data.get(spec.field, MISSING)
+            if value is MISSING:
+                if spec.default is MISSING:
+                    errors[spec.field] = ["Field '{}' is required".format(spec.field)]
+                    continue
+                value = spec.default
+
+            field_errors = spec.check(value)
+            if field_errors:
+                errors[spec.field] = field_errors
+            else:
+                values[spec.field] = value
+        return values, errors
+
+
+class JsonRequest(falcon.Request):
+    """Request whose JSON body is only read and parsed on first access of `json`
+
+    Used with `falcon.App(request_type=JsonRequest)`, `JsonMiddleware` installs
+    the loader instead of parsing every body up front.
+    """
+
+    json_loader: "typing.Optional[typing.Callable[[], typing.Any]]" = None
+
+    @property
+    def json(self):
+        try:
+            return self.__dict__["_json"]
+        except KeyError:
+            pass
+
+        value = self.json_loader() if self.json_loader is not None else {}
+        self.__dict__["_json"] = value
+        return value
+
+    @json.setter
+    def json(self, value):
+        self.__dict__["_json"] = value
 
 
 class JsonMiddleware(object):
-    def __init__(self, help_messages=True):
-        """help_messages: display validation/error messages"""
+    def __init__(
+        self,
+        help_messages=True,
+        codec=json_codec,
+        max_body_size: "typing.Optional[int]" = None,
+        route_max_body_sizes: "typing.Optional[typing.Dict[str, int]]" = None,
+    ):
+        """help_messages: display validation/error messages
+        codec: module/object with `loads(bytes)` and `dumps(obj) -> bytes`
+        max_body_size: limit in bytes for request bodies, None for no limit
+        route_max_body_sizes: limits by route template, a resource may also
+            set a `max_body_size` attribute
+        """
         self.debug = bool(help_messages)
+        self.codec = codec
+        self.max_body_size = max_body_size
+        self.route_max_body_sizes = route_max_body_sizes or {}
 
     def bad_request(self, title, description):
         """Shortcut to respond with 400 Bad Request"""
@@ -40,14 +187,14 @@ class JsonMiddleware(object):
         else:
             raise falcon.HTTPBadRequest()
 
-    def get_json(self, field, **kwargs):
+    def get_json(self, req, field, **kwargs):
         """Helper to access JSON fields in the request body
 
-        Optional built-in validators.
+        Optional built-in validators, bound to the request as `req.get_json(field, **kwargs)`.
         """
         value = None
-        if field in self.req.json:
-            value = self.req.json[field]
+        if field in req.json:
+            value = req.json[field]
             kwargs.pop("default", None)
         elif "default" not in kwargs:
             self.bad_request(
@@ -78,75 +225,88 @@ class JsonMiddleware(object):
         match      regular expression
         choices    list to which the value should be limited
         """
-        err_title = "Validation error"
-
-        if dtype:
-            if dtype == str and type(value) in six.string_types:
-                pass
-
-            elif type(value) is not dtype:
-                msg = "Data type for '{}' is '{}' but should be '{}'"
-                self.bad_request(
-                    err_title, msg.format(field, 
-                                          type(value).__name__, 
-                                          dtype.__name__)
-                )
-
-        if type(value) in six.string_types:
-            if min and len(value) < min:
-                self.bad_request(
-                    err_title, "Minimum length for '{}' is '{}'".format(field, min)
-                )
-
-            if max and len(value) > max:
-                self.bad_request(
-                    err_title, "Maximum length for '{}' is '{}'".format(field, max)
-                )
-
-        elif type(value) in (int, float):
-            if min and value < min:
-                self.bad_request(
-                    err_title, "Minimum value for '{}' is '{}'".format(field, min)
-                )
-
-            if max and value > max:
-                self.bad_request(
-                    err_title, "Maximum value for '{}' is '{}'".format(field, max)
-                )
+        key = (field, dtype, min, max, match, tuple(choices) if choices else None)
+        try:
+            spec = _field_specs[key]
+        except KeyError:
+            if len(_field_specs) >= 1024:
+                _field_specs.clear()
+            spec = _field_specs[key] = FieldSpec(field, dtype, MISSING, min, max, match, choices)
+        except TypeError:
+            # unhashable choices cannot be cached
+            spec = FieldSpec(field, dtype, MISSING, min, max, match, choices)
+        errors = spec.check(value)
+        if errors:
+            self.bad_request("Validation error", errors[0])
+        return value
 
-        if match and not re.match(match, re.escape(value)):
-            self.bad_request(
-                err_title, "'{}' does not match Regex: {}".format(field, match)
+    def payload_too_large(self, limit):
+        """Shortcut to respond with 413 Payload Too Large"""
+        if self.debug:
+            raise falcon.HTTPPayloadTooLarge(
+                title="Payload too large",
+                description="Request body is limited to {} bytes".format(limit),
             )
+        else:
+            raise falcon.HTTPPayloadTooLarge()
 
-        if choices and value not in choices:
-            self.bad_request(err_title, "{} must be one of {}".format(field, choices))
-        return value
+    def body_limit(self, req: "falcon.Request", resource) -> "typing.Optional[int]":
+        limit = getattr(resource, "max_body_size", None)
+        if limit is None:
+            limit = self.route_max_body_sizes.get(req.uri_template, self.max_body_size)
+        return limit
 
-    def process_request(self, req: "falcon.Request", resp):
-        """Middleware request"""
+    def read_json(self, req: "falcon.Request", limit: "typing.Optional[int]"):
+        """Read and parse the body, never buffering more than `limit` + 1 bytes"""
+        if limit is None:
+            body = req.bounded_stream.read()
+        else:
+            body = req.bounded_stream.read(limit + 1)
+            if len(body) > limit:
+                self.payload_too_large(limit)
 
+        try:
+            return self.codec.loads(body)
+        except UnicodeDecodeError:
+            self.bad_request("Invalid encoding", "Could not decode as UTF-8")
+        except ValueError:
+            self.bad_request("Malformed JSON", "Syntax error")
+
+    def has_json_body(self, req: "falcon.Request") -> bool:
         if (
             getattr(req, "content_type", None)
             and "multipart/form-data" in req.content_type
         ):
+            return False
+
+        return bool(getattr(req, "content_length", None))
+
+    def process_request(self, req: "falcon.Request", resp):
+        """Middleware request"""
+        if not self.has_json_body(req):
             return
 
-        if not getattr(req, "content_length", None):
+        req.get_json = functools.partial(self.get_json, req)  # helper function
+
+    def process_resource(self, req: "falcon.Request", resp, resource, params):
+        """Enforce the route's body limit before anything is read
+
+        The body is parsed lazily for `JsonRequest`, eagerly otherwise.
+        """
+        if not self.has_json_body(req):
             return
 
-        body = req.stream.read()
-        req.json = {}
-        self.req = req
-        req.get_json = self.get_json  # helper function
-        try:
-            req.json = json.loads(body.decode("utf-8"))
-        except UnicodeDecodeError:
-            self.bad_request("Invalid encoding", "Could not decode as UTF-8")
-        except ValueError:
-            self.bad_request("Malformed JSON", "Syntax error")
+        limit = self.body_limit(req, resource)
+        if limit is not None and req.content_length > limit:
+            self.payload_too_large(limit)
+
+        if isinstance(req, JsonRequest):
+            req.json_loader = functools.partial(self.read_json, req, limit)
+        else:
+            req.json = {}
+            req.json = self.read_json(req, limit)
 
     def process_response(self, req, resp, resource, req_succeeded):
         """Middleware response"""
         if getattr(resp, "json", None) is not None:
-            resp.body = str.encode(bs.dumps(resp.json))
+            resp.data = self.codec.dumps(resp.json)
@@ -1,7 +1,11 @@
+import os
 import enum
+import time
 import typing
+import threading
 import structlog
 import commons_falcon.errors as errors
+from commons_falcon.circuit_breaker import CircuitBreaker
 
 logger = structlog.get_logger(__name__)
 
@@ -14,7 +18,250 @@ try:
     import limits
 except ImportError as e:
     logger.warn("limits module not found")
-    
+
+
+# Checks every limit of a route and only then increments all of them, in the
+# key layout of the `limits` redis storage (counters for fixed/elastic windows,
+# timestamp lists for moving windows). A blocked request consumes nothing.
+# KEYS: one per limit, ARGV: now, strategy, then amount and expiry per limit.
+# Returns {index of the blocking limit (0 if none), its reset time}.
+HIT_ALL_SCRIPT = """
+local now = tonumber(ARGV[1])
+local strategy = ARGV[2]
+
+for i = 1, #KEYS do
+    local amount = tonumber(ARGV[i * 2 + 1])
+    local expiry = tonumber(ARGV[i * 2 + 2])
+    if strategy == 'moving' then
+        local entry = redis.call('lindex', KEYS[i], amount - 1)
+        if entry and tonumber(entry) >= now - expiry then
+            return {i, tostring(tonumber(entry) + expiry)}
+        end
+    else
+        local current = tonumber(redis.call('get', KEYS[i]) or '0')
+        if current + 1 > amount then
+            if strategy == 'elastic' then
+                redis.call('expire', KEYS[i], expiry)
+            end
+            local ttl = redis.call('pttl', KEYS[i])
+            if ttl < 0 then
+                ttl = expiry * 1000
+            end
+            return {i, tostring(now + ttl / 1000)}
+        end
+    end
+end
+
+for i = 1, #KEYS do
+    local amount = tonumber(ARGV[i * 2 + 1])
+    local expiry = tonumber(ARGV[i * 2 + 2])
+    if strategy == 'moving' then
+        redis.call('lpush', KEYS[i], ARGV[1])
+        redis.call('ltrim', KEYS[i], 0, amount - 1)
+        redis.call('expire', KEYS[i], expiry)
+    else
+        local current = redis.call('incr', KEYS[i])
+        if current == 1 or strategy == 'elastic' then
+            redis.call('expire', KEYS[i], expiry)
+        end
+    end
+end
+
+return {0, '0'}
+"""
+
+# Adds the counts a worker admitted locally since its last sync and reads
+# back the window of every key. KEYS: one per window, ARGV: now, strategy,
+# then count, amount and expiry per window.
+# Returns {current count, reset time} per window.
+SYNC_SCRIPT = """
+local now = tonumber(ARGV[1])
+local strategy = ARGV[2]
+local result = {}
+
+for i = 1, #KEYS do
+    local count = tonumber(ARGV[i * 3])
+    local amount = tonumber(ARGV[i * 3 + 1])
+    local expiry = tonumber(ARGV[i * 3 + 2])
+    local current = 0
+    local reset = now + expiry
+    if strategy == 'moving' then
+        if count > 0 then
+            for j = 1, math.min(count, amount) do
+                redis.call('lpush', KEYS[i], ARGV[1])
+            end
+            redis.call('ltrim', KEYS[i], 0, amount - 1)
+            redis.call('expire', KEYS[i], expiry)
+        end
+        local entries = redis.call('lrange', KEYS[i], 0, amount - 1)
+        for j = 1, #entries do
+            if tonumber(entries[j]) < now - expiry then
+                break
+            end
+            current = j
+            reset = tonumber(entries[j]) + expiry
+        end
+    else
+        if count > 0 then
+            current = redis.call('incrby', KEYS[i], count)
+            if current == count or strategy == 'elastic' then
+                redis.call('expire', KEYS[i], expiry)
+            end
+        else
+            current = tonumber(redis.call('get', KEYS[i]) or '0')
+        end
+        local ttl = redis.call('pttl', KEYS[i])
+        if ttl >= 0 then
+            reset = now + ttl / 1000
+        end
+    end
+    result[i * 2 - 1] = current
+    result[i * 2] = tostring(reset)
+end
+
+return result
+"""
+
+
+class LocalRateLimiter:
+    """Per-worker share of the route limits, reconciled with Redis in batches.
+
+    A worker admits up to `share` of each limit on its own between syncs;
+    a daemon thread adds the admitted counts to Redis every `sync_interval`
+    seconds and reads back the global count and reset time. A limit known to
+    be exhausted is refused locally until its reset time. When a worker used
+    up its share before the next sync it syncs that key inline, so a smaller
+    `share` or `sync_interval` is more accurate and costs more Redis calls.
+    Between syncs each worker can over-admit by at most its share.
+    """
+
+    class Window:
+        __slots__ = ("amount", "expiry", "quota", "pending", "remote", "reset", "blocked_until")
+
+        def __init__(self, amount: int, expiry: int, share: float):
+            self.amount = amount
+            self.expiry = expiry
+            self.quota = max(1, int(amount * share))
+            self.pending = 0
+            self.remote = 0
+            self.reset = None
+            self.blocked_until = 0
+
+    def __init__(self, client, strategy: str, share: float = 0.1, sync_interval: float = 0.1):
+        self.strategy = strategy
+        self.share = share
+        self.sync_interval = sync_interval
+        self.__sync = client.register_script(SYNC_SCRIPT)
+        self.__windows: "typing.Dict[str, LocalRateLimiter.Window]" = {}
+        self.__lock = threading.Lock()
+        self.__start_lock = threading.Lock()
+        self.__pid = None
+
+    def start(self) -> None:
+        """Start the sync thread of the current process, called lazily on first hit"""
+        if self.__pid == os.getpid():
+            return
+
+        with self.__start_lock:
+            if self.__pid == os.getpid():
+                return
+            thread = threading.Thread(target=self.__run, name="rate-limit-sync", daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+
+    def hit(self, limiters: "typing.List[limits.RateLimitItem]", *identifiers) -> "typing.Tuple[typing.Optional[limits.RateLimitItem], int]":
+        self.start()
+        keys = [limit_item.key_for(*identifiers) for limit_item in limiters]
+        with self.__lock:
+            windows = [self.__window(key, limit_item) for key, limit_item in zip(keys, limiters)]
+            blocking_limit_item, reset_time, exhausted = self.__admit(keys, limiters, windows, time.time())
+        if not exhausted:
+            return blocking_limit_item, reset_time
+
+        self.sync(exhausted)
+        with self.__lock:
+            blocking_limit_item, reset_time, _ = self.__admit(keys, limiters, windows, time.time(), True)
+        return blocking_limit_item, reset_time
+
+    def sync(self, keys: "typing.Optional[typing.List[str]]" = None) -> None:
+        """Push the locally admitted counts of `keys` (all pending by default) to Redis
+
+        On failure the counts are kept for the next sync and the error is raised,
+        so an inline sync from `hit` counts towards the middleware's circuit breaker.
+        """
+        with self.__lock:
+            if keys is None:
+                keys = [key for key, window in self.__windows.items() if window.pending]
+            batch = [(key, self.__windows[key]) for key in keys if key in self.__windows]
+            counts = [window.pending for _, window in batch]
+            for _, window in batch:
+                window.pending = 0
+        if not batch:
+            return
+
+        now = time.time()
+        args = [now, self.strategy]
+        for (_, window), count in zip(batch, counts):
+            args += [count, window.amount, window.expiry]
+        try:
+            result = self.__sync(keys=[key for key, _ in batch], args=args)
+        except Exception:
+            with self.__lock:
+                for (_, window), count in zip(batch, counts):
+                    window.pending += count
+            raise
+
+        with self.__lock:
+            for index, (_, window) in enumerate(batch):
+                window.remote = int(result[index * 2])
+                window.reset = float(result[index * 2 + 1])
+                if window.remote >= window.amount:
+                    window.blocked_until = window.reset
+
+    def __window(self, key: str, limit_item: "limits.RateLimitItem") -> "LocalRateLimiter.Window":
+        window = self.__windows.get(key)
+        if window is None:
+            window = self.__windows[key] = self.Window(limit_item.amount, limit_item.get_expiry(), self.share)
+        return window
+
+    def __admit(self, keys, limiters, windows, now: float, synced: bool = False):
+        """Blocking limit and reset time, and the keys whose local share ran out"""
+        exhausted = []
+        for key, limit_item, window in zip(keys, limiters, windows):
+            if window.blocked_until > now:
+                return limit_item, int(window.blocked_until), []
+            if window.reset is not None and window.reset <= now:
+                window.remote, window.reset = 0, None
+            if window.remote + window.pending >= window.amount:
+                window.blocked_until = window.reset or now + window.expiry
+                return limit_item, int(window.blocked_until), []
+            if window.pending >= window.quota and not synced:
+                exhausted.append(key)
+        if exhausted:
+            return None, 0, exhausted
+
+        for window in windows:
+            window.pending += 1
+        return None, 0, []
+
+    def __run(self) -> None:
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+                self.__prune(time.time())
+            except Exception as e:
+                logger.error("rate limit sync failed", error=str(e))
+
+    def __prune(self, now: float) -> None:
+        with self.__lock:
+            idle = [
+                key for key, window in self.__windows.items()
+                if not window.pending and window.blocked_until <= now and (window.reset is None or window.reset <= now)
+            ]
+            for key in idle:
+                del self.__windows[key]
+
 
 class RateLimitingMiddleware:
     
@@ -22,22 +269,95 @@ class RateLimitingMiddleware:
         FIXED_WINDOW = 1
         ELASTIC_WINDOW = 2
         MOVING_WINDOW = 3
+
+    class Key:
+        """Counter identifiers `(req) -> tuple` for `config["key"]` and `apply_limits(key=...)`"""
+
+        @staticmethod
+        def path(req: "falcon.Request") -> tuple:
+            return (req.path, req.method)
+
+        @staticmethod
+        def route(req: "falcon.Request") -> tuple:
+            return (req.uri_template or req.path, req.method)
+
+        @staticmethod
+        def ip(req: "falcon.Request") -> tuple:
+            return ("ip", req.access_route[0] if req.access_route else req.remote_addr)
+
+        @staticmethod
+        def subject(req: "falcon.Request") -> tuple:
+            """`sub` of the verified JWT set by `SimpleAuthMiddleware`, the client IP otherwise"""
+            payload = req.context.get("authorization_payload")
+            subject = payload.get("sub") if isinstance(payload, dict) else None
+            if subject is None:
+                return RateLimitingMiddleware.Key.ip(req)
+            return ("sub", subject)
+
+        @staticmethod
+        def client(req: "falcon.Request") -> tuple:
+            """CLIENT-ID header, the client IP otherwise"""
+            client_id = req.get_header("CLIENT-ID") or req.get_header("CLIENTID")
+            if client_id is None:
+                return RateLimitingMiddleware.Key.ip(req)
+            return ("client", client_id)
+
+        @staticmethod
+        def combine(*keys: "typing.Callable[[falcon.Request], tuple]") -> "typing.Callable[[falcon.Request], tuple]":
+            """e.g. `Key.combine(Key.route, Key.subject)` for per-user limits of each route"""
+            return lambda req: tuple(identifier for key in keys for identifier in key(req))
     
     def __init__(self, config: "type.Dict"):
+        """config: `url` or `host`/`port`[/`username`/`password`] of Redis and the window `type`.
+        `local_share` (e.g. 0.1) enables the hybrid mode of `LocalRateLimiter`,
+        synced every `sync_interval` seconds (default 0.1).
+        `key` identifies the counters (default `Key.path`, path and method).
+        `timeout` is the latency budget of a Redis call in seconds; failing or
+        slower calls count towards a circuit breaker (`failure_threshold`,
+        `reset_timeout`) and the request is let through (`fallback="open"`,
+        default) or checked by an in-process limiter (`fallback="memory"`).
+        """
         self.__limiters = {}
+        self.__keys = {}
         self.__config = config
+        self.__key = self.__config.get("key") or self.Key.path
+        self.__timeout = self.__config.get("timeout")
+        options = {}
+        if self.__timeout:
+            options = {"socket_timeout": self.__timeout, "socket_connect_timeout": self.__timeout}
         if self.__config.get('url'):
-            self.__storage = limits.storage.RedisStorage(self.__config['url'])
+            self.__storage = limits.storage.RedisStorage(self.__config['url'], **options)
         elif self.__config.get('password'):
-            self.__storage = limits.storage.RedisStorage(f"redis://{self.__config['username']}:{self.__config['password']}@{self.__config['host']}:{self.__config['port']}")
+            self.__storage = limits.storage.RedisStorage(f"redis://{self.__config['username']}:{self.__config['password']}@{self.__config['host']}:{self.__config['port']}", **options)
         else:
-            self.__storage = limits.storage.RedisStorage(f"redis://{self.__config['host']}:{self.__config['port']}")
+            self.__storage = limits.storage.RedisStorage(f"redis://{self.__config['host']}:{self.__config['port']}", **options)
         if self.__config["type"] == self.Type.FIXED_WINDOW:
             self.__strategy = limits.strategies.FixedWindowRateLimiter(self.__storage)
         elif self.__config["type"] == self.Type.ELASTIC_WINDOW:
             self.__strategy = limits.strategies.FixedWindowElasticExpiryRateLimiter(self.__storage)
         elif self.__config["type"] == self.Type.MOVING_WINDOW:
             self.__strategy = limits.strategies.MovingWindowRateLimiter(self.__storage)
+        self.__script_strategy = {
+            self.Type.FIXED_WINDOW: "fixed",
+            self.Type.ELASTIC_WINDOW: "elastic",
+            self.Type.MOVING_WINDOW: "moving",
+        }[self.__config["type"]]
+        self.__hit_all = self.__storage.storage.register_script(HIT_ALL_SCRIPT)
+        self.__local = None
+        if self.__config.get("local_share"):
+            self.__local = LocalRateLimiter(
+                self.__storage.storage,
+                self.__script_strategy,
+                share=self.__config["local_share"],
+                sync_interval=self.__config.get("sync_interval", 0.1),
+            )
+        self.__breaker = CircuitBreaker(
+            failure_threshold=self.__config.get("failure_threshold", 5),
+            reset_timeout=self.__config.get("reset_timeout", 30),
+        )
+        self.__fallback = None
+        if self.__config.get("fallback") == "memory":
+            self.__fallback = type(self.__strategy)(limits.storage.MemoryStorage())
     
     @property
     def middleware(self):
@@ -47,18 +367,58 @@ class RateLimitingMiddleware:
         namespace = f"{resource.__class__.__name__}.on_{req.method.lower()}"
         limiters = self.__limiters.get(namespace)
         if limiters is not None and isinstance(limiters, list):
-            blocking_limit_item = next(filter(lambda limit_item: self.__strategy.hit(limit_item, req.path, req.method) == False, limiters), None)
+            identifiers = self.__keys.get(namespace, self.__key)(req)
+            blocking_limit_item, reset_time = self.__guarded_hit(limiters, identifiers)
             if blocking_limit_item is not None:
                 resp.complete = True
-                reset_time, _ = self.__strategy.get_window_stats(blocking_limit_item, req.path, req.method)
-                resp.append_header('X-Rate-Limit-ResetTime',reset_time)
+                resp.append_header('X-Rate-Limit-ResetTime', str(reset_time))
                 raise errors.RateLimitError()
+
+    def hit(self, limiters: "typing.List[limits.RateLimitItem]", *identifiers) -> "typing.Tuple[typing.Optional[limits.RateLimitItem], int]":
+        """Check and increment all `limiters` in one round trip
+
+        Returns the first blocking limit and its reset time (epoch seconds),
+        or `(None, 0)` when every limit was incremented.
+        """
+        args = [time.time(), self.__script_strategy]
+        for limit_item in limiters:
+            args += [limit_item.amount, limit_item.get_expiry()]
+        index, reset_time = self.__hit_all(keys=[limit_item.key_for(*identifiers) for limit_item in limiters], args=args)
+        if not index:
+            return None, 0
+        return limiters[index - 1], int(float(reset_time))
+
+    def __guarded_hit(self, limiters: "typing.List[limits.RateLimitItem]", identifiers: tuple):
+        if self.__breaker.allow():
+            hit = self.__local.hit if self.__local is not None else self.hit
+            started = time.monotonic()
+            try:
+                result = hit(limiters, *identifiers)
+            except Exception as e:
+                self.__breaker.record_failure()
+                logger.error("rate limit check failed", error=str(e), state=self.__breaker.state.value)
+            else:
+                if self.__timeout and time.monotonic() - started > self.__timeout:
+                    self.__breaker.record_failure()
+                else:
+                    self.__breaker.record_success()
+                return result
+
+        if self.__fallback is None:
+            return None, 0
+        blocking_limit_item = next(filter(lambda limit_item: not self.__fallback.hit(limit_item, *identifiers), limiters), None)
+        if blocking_limit_item is None:
+            return None, 0
+        reset_time, _ = self.__fallback.get_window_stats(blocking_limit_item, *identifiers)
+        return blocking_limit_item, int(reset_time)
     
-    def apply_limits(self, limiters: "typing.List[str]"):
+    def apply_limits(self, limiters: "typing.List[str]", key: "typing.Optional[typing.Callable[[falcon.Request], tuple]]" = None):
         
         def hook_func(func):
             namespace = f"{func.__qualname__}"
             self.__limiters[namespace] = list(map(lambda x: limits.parse(x), limiters))
+            if key is not None:
+                self.__keys[namespace] = key
             return func
             
         return hook_func
@@ -1,7 +1,13 @@
+import os
+import gzip
+import fcntl
+import contextlib
+import threading
 import structlog
-from time import perf_counter
+from time import perf_counter, monotonic
 from prometheus_client import multiprocess
-from prometheus_client import CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, Counter, Summary
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, Counter, Histogram
+from prometheus_client.mmap_dict import MmapedDict
 
 
 logger = structlog.get_logger(__name__)
@@ -11,51 +17,186 @@ middleware = None
 route = None
 metrics = None
 
-def configure_falcon_prometheus(workers=False):
+UNMATCHED_ROUTE = "__unmatched__"
+DEFAULT_SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float("inf"))
+
+# per-pid files of these types are summed into `<type>_aggregate.db` once the pid is dead
+COMPACTED_TYPES = ("counter", "histogram", "summary")
+
+
+def multiprocess_dir(path=None) -> str:
+    return path or os.environ.get('PROMETHEUS_MULTIPROC_DIR', os.environ.get('prometheus_multiproc_dir'))
+
+
+@contextlib.contextmanager
+def multiprocess_lock(path, exclusive: bool):
+    """Keeps scrapes from reading a dead pid's files while they are being compacted"""
+    with open(os.path.join(path, ".compact.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def mark_process_dead(pid, path=None):
+    """Compact the metric files of a dead worker, call it from gunicorn's `child_exit`
+
+        def child_exit(server, worker):
+            commons_falcon.prometheus.mark_process_dead(worker.pid)
+
+    Live gauges of the pid are dropped (`multiprocess.mark_process_dead`),
+    its counters, histograms and summaries are added to `<type>_aggregate.db`
+    and its files removed, so scrapes read a bounded number of files however
+    often workers are recycled.
+    """
+    path = multiprocess_dir(path)
+    multiprocess.mark_process_dead(pid, path)
+
+    with multiprocess_lock(path, exclusive=True):
+        for typ in COMPACTED_TYPES:
+            dead = os.path.join(path, f"{typ}_{pid}.db")
+            if not os.path.exists(dead):
+                continue
+
+            aggregate = os.path.join(path, f"{typ}_aggregate.db")
+            totals = {}
+            for filename in (aggregate, dead):
+                if not os.path.exists(filename):
+                    continue
+                # (key, value, pos), newer clients also carry a timestamp before pos
+                for key, value, *rest in MmapedDict.read_all_values_from_file(filename):
+                    extra = rest[:-1]
+                    if key in totals:
+                        totals[key][0] += value
+                    else:
+                        totals[key] = [value, *extra]
+
+            compacted = aggregate + ".tmp"
+            values = MmapedDict(compacted)
+            try:
+                for key, value in totals.items():
+                    values.write_value(key, *value)
+            finally:
+                values.close()
+            os.replace(compacted, aggregate)
+            os.remove(dead)
+
+
+def configure_falcon_prometheus(workers=False, buckets=Histogram.DEFAULT_BUCKETS, size_buckets=DEFAULT_SIZE_BUCKETS, cache_ms=0, gzipped=False):
+    """Metrics are labelled with the route template (`req.uri_template`), not the
+    raw path, to keep the number of series bounded; requests that matched no
+    route are labelled `__unmatched__`. `buckets` and `size_buckets` are the
+    histogram buckets of the processing time (seconds) and payload size (bytes).
+
+    The exposition of `route` is reused for `cache_ms` milliseconds and, with
+    `gzipped`, also kept gzip encoded for scrapers that accept it. With
+    `workers`, see `mark_process_dead` to keep the multiprocess directory small.
+    """
     global registry
     global middleware
     global metrics
     global route
 
-    registry = CollectorRegistry()
-
     if workers:
+        registry = CollectorRegistry()
         multiprocess.MultiProcessCollector(registry)
+    else:
+        # the metrics below register themselves with the default registry
+        registry = REGISTRY
 
     NUM_INCOMING_REQUESTS = Counter("http_incoming_requests", "Total HTTP Requests", labelnames=["method", "path", "host"])  
     NUM_INCOMING_PROCESSED_REQUESTS = Counter("http_incoming_processed_requests", "Total HTTP Requests Processed", labelnames=["method", "path", "host", "status"])
-    REQUEST_TIME = Summary('http_incoming_requests_processing_seconds', 'Time spent processing request', labelnames=["method", "path", "host", "status"])
-    REQUEST_PAYLOAD_SIZE = Summary('http_incoming_requests_payload_size', 'Request Payload Size', labelnames=["method", "path", "host", "status"])
+    REQUEST_TIME = Histogram('http_incoming_requests_processing_seconds', 'Time spent processing request', labelnames=["method", "path", "host", "status"], buckets=buckets)
+    REQUEST_PAYLOAD_SIZE = Histogram('http_incoming_requests_payload_size', 'Request Payload Size', labelnames=["method", "path", "host", "status"], buckets=size_buckets)
+
+    # bound label children, keyed by label values
+    incoming = {}
+    processed = {}
+
+    def count_incoming(req: "falcon.Request", path: str):
+        key = (req.method, path, req.host)
+        child = incoming.get(key)
+        if child is None:
+            child = incoming[key] = NUM_INCOMING_REQUESTS.labels(*key)
+        child.inc()
 
     class PrometheusMiddleware():
 
         def process_request(self, req: "falcon.Request", *args, **kwargs):
-            NUM_INCOMING_REQUESTS.labels(method=req.method, path=req.path, host=req.host).inc()
             req.start_time = perf_counter()
-            
+
+        def process_resource(self, req: "falcon.Request", resp: "falcon.Response", resource: "object", params: "dict"):
+            req.context["prometheus_counted"] = True
+            count_incoming(req, req.uri_template)
 
         def process_response(self, req: "falcon.Response", resp: "falcon.Response", resource: "object", req_succeeded: "bool"):
-            NUM_INCOMING_PROCESSED_REQUESTS.labels(method=req.method, path=req.path, host=req.host, status=resp.status)
-            REQUEST_TIME.labels(method=req.method, path=req.path, host=req.host, status=resp.status).observe(perf_counter() - req.start_time)
-            REQUEST_PAYLOAD_SIZE.labels(method=req.method, path=req.path, host=req.host, status=resp.status).observe(len(resp.body or []))
+            path = req.uri_template
+            if resource is None or path is None:
+                path = UNMATCHED_ROUTE
+
+            # process_resource is skipped when an earlier middleware rejected the request
+            if "prometheus_counted" not in req.context:
+                count_incoming(req, path)
+
+            key = (req.method, path, req.host, resp.status)
+            children = processed.get(key)
+            if children is None:
+                labels = key[:3] + (str(resp.status),)
+                children = processed[key] = (
+                    NUM_INCOMING_PROCESSED_REQUESTS.labels(*labels),
+                    REQUEST_TIME.labels(*labels),
+                    REQUEST_PAYLOAD_SIZE.labels(*labels),
+                )
+            children[0].inc()
+            children[1].observe(perf_counter() - req.start_time)
+            children[2].observe(len(resp.data or resp.text or b""))
+
+    exposition = {"expires_at": 0.0, "data": b"", "gzipped": None}
+    exposition_lock = threading.Lock()
+
+    def expose():
+        if exposition["expires_at"] > monotonic():
+            return exposition
+
+        with exposition_lock:
+            if exposition["expires_at"] > monotonic():
+                return exposition
+
+            if workers:
+                with multiprocess_lock(multiprocess_dir(), exclusive=False):
+                    data = generate_latest(registry)
+            else:
+                data = generate_latest(registry)
+            logger.debug(data)
+
+            exposition["data"] = data
+            exposition["gzipped"] = gzip.compress(data, compresslevel=6) if gzipped else None
+            exposition["expires_at"] = monotonic() + cache_ms / 1000
+        return exposition
 
     class MetricsRoute():
 
         def on_get(self, req: "falcon.Request", resp: "falcon.Response", *args, **kwargs):
-            data = generate_latest(registry)
-            logger.debug(data)
+            current = expose()
 
             resp.headers["Content-Type"] = CONTENT_TYPE_LATEST
             resp.content_type = CONTENT_TYPE_LATEST
-            resp.data = data
+            if current["gzipped"] is not None:
+                resp.vary = ("Accept-Encoding",)
+                if "gzip" in (req.get_header("Accept-Encoding") or ""):
+                    resp.set_header("Content-Encoding", "gzip")
+                    resp.data = current["gzipped"]
+                    return
+            resp.data = current["data"]
 
 
 
     middleware = PrometheusMiddleware
     metrics = {
-        'NUM_INCOMING_REQUESTS': NUM_INCOMING_PROCESSED_REQUESTS,
+        'NUM_INCOMING_REQUESTS': NUM_INCOMING_REQUESTS,
         'NUM_INCOMING_PROCESSED_REQUESTS': NUM_INCOMING_PROCESSED_REQUESTS,
         'REQUEST_TIME': REQUEST_TIME,
         'REQUEST_PAYLOAD_SIZE': REQUEST_PAYLOAD_SIZE,
     }
-    route = MetricsRoute
\ No newline at end of file
+    route = MetricsRoute
@@ -0,0 +1,127 @@
+"""Parity of `compile_dumper` with `marshmallow.Schema.dump`"""
+import decimal
+
+import pytest
+import marshmallow as ma
+
+from commons_falcon.hooks.serialize_schema import compile_dumper
+
+
+class Plain(ma.Schema):
+    name = ma.fields.String()
+    count = ma.fields.Integer()
+    ratio = ma.fields.Float()
+    active = ma.fields.Boolean()
+    extra = ma.fields.Raw()
+
+
+class Renamed(ma.Schema):
+    name = ma.fields.String(data_key="fullName")
+    code = ma.fields.String(attribute="country_code")
+    both = ma.fields.Integer(attribute="source", data_key="target")
+
+
+def default_tags():
+    return ["x"]
+
+
+class Defaults(ma.Schema):
+    name = ma.fields.String(dump_default="anonymous")
+    tags = ma.fields.Raw(dump_default=default_tags)
+    count = ma.fields.Integer()
+    secret = ma.fields.String(load_only=True)
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Item(object):
+    """Supports item access like mongoengine documents"""
+
+    def __init__(self, **kwargs):
+        self.__data = kwargs
+
+    def __getitem__(self, key):
+        return self.__data[key]
+
+
+def assert_parity(schema, obj):
+    dumper = compile_dumper(schema)
+    assert dumper is not None
+    assert dumper(obj) == schema.dump(obj)
+
+
+@pytest.mark.parametrize("make", [dict, Obj, Item], ids=["dict", "object", "getitem"])
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"name": "a", "count": 1, "ratio": 0.5, "active": True, "extra": {"k": [1]}},
+        {"name": 5, "count": "7", "ratio": 2, "active": "true", "extra": None},
+        {"name": None, "count": None, "ratio": None, "active": None},
+        {"count": 3.9, "ratio": decimal.Decimal("1.25"), "active": 0},
+        {},
+    ],
+)
+def test_plain_fields(make, data):
+    assert_parity(Plain(), make(**data))
+
+
+@pytest.mark.parametrize("make", [dict, Obj, Item], ids=["dict", "object", "getitem"])
+def test_data_key_and_attribute(make):
+    assert_parity(Renamed(), make(name="a", country_code="IN", source=4))
+    assert_parity(Renamed(), make(name="a"))
+
+
+@pytest.mark.parametrize("make", [dict, Obj, Item], ids=["dict", "object", "getitem"])
+def test_dump_default_and_load_only(make):
+    assert_parity(Defaults(), make(secret="s"))
+    assert_parity(Defaults(), make(name="b", tags=["y"], count=2, secret="s"))
+
+
+def test_dict_falls_back_to_attributes():
+    class Mapping(dict):
+        name = "from attribute"
+
+    assert_parity(Plain(), Mapping(count=1))
+
+
+def test_only_and_exclude():
+    assert_parity(Plain(only=("name", "count")), {"name": "a", "count": 1, "ratio": 1.0})
+    assert_parity(Plain(exclude=("extra",)), {"name": "a", "extra": 1})
+
+
+class Hooked(ma.Schema):
+    name = ma.fields.String()
+
+    @ma.post_dump
+    def upper(self, data, **kwargs):
+        return {key: value.upper() for key, value in data.items()}
+
+
+class Dotted(ma.Schema):
+    city = ma.fields.String(attribute="address.city")
+
+
+class Typed(ma.Schema):
+    at = ma.fields.DateTime()
+
+
+class Nested(ma.Schema):
+    plain = ma.fields.Nested(Plain)
+
+
+class AsString(ma.Schema):
+    count = ma.fields.Integer(as_string=True)
+
+
+class CustomGetter(Plain):
+    def get_attribute(self, obj, attr, default):
+        return "custom"
+
+
+@pytest.mark.parametrize("schema", [Hooked, Dotted, Typed, Nested, AsString, CustomGetter])
+def test_unsupported_schemas_are_not_compiled(schema):
+    assert compile_dumper(schema()) is None
+